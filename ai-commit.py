@@ -15,7 +15,9 @@ commit message.
     pip install google-genai
 
 2.  You need to configure your Gemini API key. The script will prompt you
-    to enter it if it's not found in the GOOGLE_API_KEY environment variable.
+    to enter it if it's not found in the GOOGLE_API_KEY environment variable
+    or the OS keyring (when the optional `keyring` package is installed, a
+    prompted key is saved there for later runs).
 
 **How it works:**
 1.  Checks for staged changes.
@@ -35,51 +37,577 @@ commit message.
 import os
 import subprocess
 import sys
+import threading
 import getpass
 import argparse
 import json
 import datetime
+import fnmatch
+import hashlib
+import math
+import zlib
 import re
-import urllib.request
-from urllib.error import URLError
-
-try:
-    from google import genai
-except ImportError:
-    print("Error: The 'google-genai' library is not installed.")
-    print("Please install it by running: pip install google-genai")
-    sys.exit(1)
+import select
+import shlex
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 # You can get your API key from Google AI Studio: https://aistudio.google.com/app/apikey
 API_KEY_ENV_VAR = "GOOGLE_API_KEY"
+# Where the key is stored when the optional `keyring` package is installed
+KEYRING_SERVICE = "ai-commit"
+KEYRING_USERNAME = "gemini"
+
+# For this script, we'll use the gemini-3-flash model
+MODEL_NAME = 'gemini-3-flash-preview'
+
+# Instructions sent with every request. They never change between runs, so
+# they are sent as the system instruction and, where possible, served from
+# a Gemini context cache instead of being re-uploaded each time.
+SYSTEM_INSTRUCTIONS = """You are an expert programmer and git user. Your task is to write a clear, concise, and conventional commit message.
+
+You will be given a 'git diff --staged' output and the recent commit history of the repository, and possibly project commit guidelines and additional context provided by the user. Analyze them to understand the context and the project's conventions.
+
+**Instructions:**
+1. Write a commit message that accurately summarizes the changes.
+2. Follow the conventional commit format if it seems to be used in the history (e.g., `feat:`, `fix:`, `refactor:`, `docs:`, `chore:`).
+3. When project-specific guidelines are provided, ensure the message follows them closely.
+4. Keep each line under 100 characters. This applies to the subject line and all body lines.
+5. After the subject, add a blank line, followed by a more detailed body explaining the 'what' and 'why' of the changes if necessary.
+6. Do not include any introductory text like "Here is the commit message:". Just provide the raw commit message.
+"""
+
+# Prompt templates, filled in with str.format_map() by
+# generate_commit_message(). Written without indentation or padding, and
+# optional sections are completely empty when unused, so that the same
+# inputs always produce byte-identical prompts (and prompt prefixes).
+
+# Project guidelines, sent ahead of the per-request prompt. They rarely
+# change, so together with the instructions they form the prompt prefix
+# that is served from the context cache (see get_cached_content()).
+GUIDELINES_SECTION_TEMPLATE = """**Project Commit Guidelines (to follow):**
+---
+{guidelines}
+---
+
+"""
+
+# Per-request part of the prompt. Most stable first, so the provider's
+# prefix caching can reuse as much of it as possible.
+PROMPT_TEMPLATE = """**Recent Commit History Style (summary and examples):**
+---
+{history}
+---
+
+**Staged Changes (git diff):**
+---
+{diff}
+---
+{context_section}"""
+
+# Replaces PROMPT_TEMPLATE when the message of a similar earlier change is
+# available: the model only has to adapt it, so the history is left out.
+ADAPT_PROMPT_TEMPLATE = """**Commit Message of a Similar Change (adapt it to the staged changes):**
+---
+{previous_message}
+---
+
+**Staged Changes (git diff):**
+---
+{diff}
+---
+{context_section}"""
+
+CONTEXT_SECTION_TEMPLATE = """
+**Additional Context (provided by user):**
+---
+{context}
+---
+"""
+
+# Separator framing the suggestion in verbose mode
+BANNER = "=" * 60
+
+# Gemini context caches are only accepted above a minimum prompt size
+# (1024 tokens for flash models); below this estimate (~4 chars per token)
+# we don't even try. Caches live for CACHE_TTL_SECONDS, and a prefix the API
+# refused to cache isn't retried for CACHE_RETRY_SECONDS.
+CACHE_MIN_CHARS = 4096
+CACHE_TTL_SECONDS = 3600
+CACHE_RETRY_SECONDS = 24 * 3600
+
+# Number of generated messages remembered per repository for reuse when
+# the same changes are staged again
+MESSAGE_CACHE_ENTRIES = 200
+
+# Semantic message cache: diffs are embedded locally (see embed_diff()),
+# and the message of a change whose embedding is at least
+# SEMANTIC_ADAPT_SIMILARITY (cosine) close is adapted to the new diff by the
+# model. It is only reused as is when the changed lines are the same.
+EMBEDDING_DIMENSIONS = 512
+SEMANTIC_ADAPT_SIMILARITY = 0.80
+EMBEDDING_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+# Base argv for every git read we issue. Commands are exec'd directly (no
+# /bin/sh in between) and colors are forced off so that a user-level
+# `color.ui=always` can't leak escape codes into the prompt.
+GIT_CMD = ["git", "--no-pager", "-c", "color.ui=never"]
+
+# Conventional Commits types, optionally scoped (`fix(parser):`) or
+# marked as breaking (`feat!:`)
+CONVENTIONAL_PREFIX_RE = re.compile(
+    r'^(feat|fix|docs|style|refactor|perf|test|chore|build|ci)(\([^)]+\))?!?:'
+)
+# Any 'word:' prefix, as tallied into the style profile by --analyze (matched
+# against the raw bytes of the subjects)
+SUBJECT_PREFIX_RE = re.compile(rb'^([A-Za-z0-9_-]+):')
+# Past-tense / progressive endings that suggest a subject isn't imperative
+NON_IMPERATIVE_RE = re.compile(r'^\w+(ed|ing)\b', re.IGNORECASE)
+# Number of verbatim subjects sent along with the style summary
+HISTORY_EXAMPLES = 3
+
+# Comment syntaxes by file extension, for spotting comment-only changes:
+# '#' is Python, 'c' is //, /* ... */ and the ' * ' continuation lines of a
+# block comment, and 'css' the same without //. Comment-only changes are
+# confirmed by lexing the whole file (see code_tokens()), so only languages
+# whose strings that lexer understands are listed: a `# line` in a shell
+# here-doc or a YAML block scalar is no comment. Files of other types are
+# never considered comment-only.
+COMMENT_STYLES = {
+    '.py': '#',
+    **dict.fromkeys(('.c', '.h', '.cc', '.cpp', '.cxx', '.hh', '.hpp', '.java', '.js',
+                     '.jsx', '.ts', '.tsx', '.go', '.rs', '.swift', '.kt', '.cs',
+                     '.scala', '.dart'), 'c'),
+    **dict.fromkeys(('.css', '.scss', '.less'), 'css'),
+}
+# Tokens of C-like sources: comments, string literals (C++ and Rust raw
+# strings, triple-quoted text blocks, JS template literals) and the rest
+C_TOKEN_RE = re.compile(r'''
+    //[^\n]* | /\*[\s\S]*?\*/
+  | R"([^()\\\s]{0,16})\([\s\S]*?\)\1"
+  | \br(\#*)"[\s\S]*?"\2
+  | """[\s\S]*?"""
+  | "(?:\\.|[^"\\\n])*"
+  | '(?:\\.|[^'\\\n])*'
+  | `(?:\\.|[^`\\])*`
+  | \w+ | \S
+''', re.VERBOSE)
+# Single-line version declarations, e.g. in package.json, pyproject.toml,
+# Cargo.toml, setup.cfg, setup.py or a module's __version__; the file is
+# then parsed to check it's the package's own version (see
+# declared_versions())
+VERSION_LINE_RE = re.compile(
+    r'^\s*("version"\s*:|version\s*=|__version__\s*=)\s*(["\']?)([^"\'\s,]+)\2,?\s*$'
+)
+VERSION_VALUE_RE = re.compile(r'^v?\d+(\.\d+)+([-+.]?[0-9A-Za-z]+)*$')
+
+# Upper bound on the size (in bytes) of the diff sent to the model. Input tokens (and
+# thus cost and latency) grow linearly with it, and huge diffs rarely help
+# the model write a better message.
+DIFF_BUDGET_BYTES = 20_000
+# The diff is filtered while git writes it; once this much has been kept,
+# only the file and hunk headers of the rest are kept (and, past twice as
+# much, only the file headers), so memory use is bounded no matter how
+# large the staged changes are, while every file is still named.
+DIFF_READ_LIMIT_BYTES = 4 * DIFF_BUDGET_BYTES
+
+# Files whose contents carry little signal for a commit message (lockfiles,
+# generated and binary assets). Only their names are sent to the model.
+LOW_SIGNAL_FILES = (
+    "*.lock", "package-lock.json", "pnpm-lock.yaml", "go.sum",
+    "*.min.js", "*.min.css", "*.map",
+    "*.svg", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.ico", "*.pdf",
+)
+
+# The google-genai SDK, imported on first use by load_genai()
+genai = None
+types = None
+
+# Process-wide API key and Gemini client, set up on first use. The client
+# may be requested from the main thread and a prefetching worker at once;
+# it is rebuilt if the key it was created with is no longer the current one.
+_api_key = None
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+# An API key typed at the prompt, saved to the OS keyring by
+# save_prompted_api_key() only once a request made with it succeeded
+_prompted_api_key = None
+
+# Largest commit message written to `git commit -F -` in one go through
+# os.pipe(); pipes hold at least this much on Linux and macOS, so the write
+# can't block before git starts reading. Longer messages go through
+# subprocess' own stdin feeding.
+COMMIT_PIPE_MAX_BYTES = 16 * 1024
+
+# How long the verbose-mode confirmation prompt waits before giving up
+# (and not committing)
+PROMPT_TIMEOUT_SECONDS = 30
+
+# Values of the command line options when they're not given
+CLI_DEFAULTS = {
+    'auto_commit': False,
+    'dry_run': False,
+    'analyze': False,
+    'history_depth': 1000,
+    'cache_file': None,
+    'force_analyze': False,
+    'context': None,
+    'guidelines': None,
+    'verbose': False,
+    'force_ai': False,
+    'no_cache': False,
+}
 
 # --- Helper Functions ---
 
-def run_command(command):
-    """Executes a shell command and returns its output."""
+def load_genai():
+    """Imports the google-genai SDK the first time it is needed.
+
+    The import is by far the slowest part of startup, so runs that exit
+    early (help, not a repository, nothing staged, --analyze) never pay it.
+    """
+    global genai, types
+    if genai is not None:
+        return
+    try:
+        from google import genai as genai_module
+        from google.genai import types as types_module
+    except ImportError:
+        print("Error: The 'google-genai' library is not installed.")
+        print("Please install it by running: pip install google-genai")
+        sys.exit(1)
+    genai, types = genai_module, types_module
+
+def decode_output(data):
+    """Decodes command output, dropping trailing whitespace.
+
+    The bytes are decoded exactly once, through a memoryview, so stripping
+    doesn't copy a potentially large buffer first.
+    """
+    end = len(data)
+    while end and data[end - 1] in b" \t\r\n":
+        end -= 1
+    return str(memoryview(data)[:end], 'utf-8', 'replace')
+
+def run_command(command, quiet=False):
+    """Executes a command (an argv list, no shell) and returns its output.
+
+    With quiet=True failures exit without printing the error, for callers
+    that handle the SystemExit themselves.
+    """
     try:
         result = subprocess.run(
             command,
-            shell=True,
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
         )
-        return result.stdout.strip()
+        return decode_output(result.stdout)
     except subprocess.CalledProcessError as e:
-        print(f"Error executing command: `{command}`")
-        print(f"Stderr: {e.stderr.strip()}")
+        if quiet:
+            sys.exit(1)
+        print(f"Error executing command: `{shlex.join(command)}`")
+        print(f"Stderr: {decode_output(e.stderr)}")
+        sys.exit(1)
+    except FileNotFoundError:
+        # Without a shell a missing executable raises instead of exiting 127
+        if quiet:
+            sys.exit(1)
+        print(f"Error executing command: `{shlex.join(command)}`")
+        print(f"Command not found: {command[0]}")
         sys.exit(1)
 
-def is_git_repository():
-    """Check if the current directory is a git repository."""
-    return os.path.isdir('.git')
+def get_git_dirs():
+    """Locates the git repository containing the current directory.
+
+    Unlike looking for `.git` in the current directory, this also works from
+    subdirectories, worktrees and submodules. Returns a (git_dir, common_dir)
+    pair, where common_dir is the directory shared by all worktrees (it
+    equals git_dir outside of linked worktrees), or None when not inside the
+    work tree of a git repository (bare repositories and the .git directory
+    itself have nothing to commit from).
+    """
+    try:
+        result = subprocess.run(
+            GIT_CMD + ["rev-parse", "--is-inside-work-tree", "--git-dir", "--git-common-dir"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    inside_work_tree, git_dir, common_dir = result.stdout.splitlines()
+    if inside_work_tree != 'true':
+        return None
+    return git_dir, common_dir
+
+def read_head_sha(git_dir, common_dir):
+    """Resolves HEAD to a commit id by reading the ref files directly.
+
+    This avoids spawning `git rev-parse HEAD`. Returns None when HEAD can't
+    be resolved this way (unborn branch, unusual ref storage); callers must
+    treat that as "unknown" rather than as an error.
+    """
+    try:
+        with open(os.path.join(git_dir, 'HEAD'), 'r', encoding='utf-8') as fh:
+            head = fh.read().strip()
+    except OSError:
+        return None
+    if not head.startswith('ref: '):
+        return head
+    ref = head[len('ref: '):]
+    # Branch refs live in the common dir; only a few special refs are
+    # per-worktree, so look there as well.
+    for base in (common_dir, git_dir):
+        try:
+            with open(os.path.join(base, ref), 'r', encoding='utf-8') as fh:
+                return fh.read().strip()
+        except OSError:
+            pass
+    try:
+        with open(os.path.join(common_dir, 'packed-refs'), 'r', encoding='utf-8') as fh:
+            for line in fh:
+                sha, _, name = line.rstrip('\n').partition(' ')
+                if name == ref:
+                    return sha
+    except OSError:
+        pass
+    return None
+
+def load_history_cache(path, head_sha):
+    """Returns the commit history cached for `head_sha`, or None on a miss."""
+    if not head_sha:
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            cached_sha, _, history = fh.read().partition('\n')
+    except OSError:
+        return None
+    return history if cached_sha == head_sha else None
+
+def save_history_cache(path, head_sha, history):
+    """Caches the commit history for `head_sha` (written atomically)."""
+    if not head_sha:
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(f"{head_sha}\n{history}")
+        os.replace(tmp, path)
+    except OSError:
+        # Non-fatal: the next run just reads the history from git again
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def message_cache_key(fingerprint):
+    """Returns the message cache key for a staged diff `fingerprint`.
+
+    The fingerprint comes from read_staged_diff() and covers the whole diff,
+    not just the part that survives compression.
+    """
+    return hashlib.sha256(f"{MODEL_NAME}\0{fingerprint}".encode('utf-8')).hexdigest()
+
+def prompt_inputs_hash(guidelines, context):
+    """Hashes the prompt inputs besides the diff that shape the message."""
+    return hashlib.sha256(f"{guidelines or ''}\0{context or ''}".encode('utf-8')).hexdigest()
+
+def load_message_cache(path):
+    """Loads the map of diff keys to generated messages (oldest first)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            cache = json.load(fh)
+    except Exception:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_message_cache(path, cache, key, entry):
+    """Stores `entry` as the most recently used one and writes the cache.
+
+    The least recently used entries are dropped beyond MESSAGE_CACHE_ENTRIES.
+    """
+    cache.pop(key, None)
+    cache[key] = entry
+    while len(cache) > MESSAGE_CACHE_ENTRIES:
+        del cache[next(iter(cache))]
+    write_json_atomically(path, cache)
+
+def write_json_atomically(path, data):
+    """Writes `data` as JSON to `path`, replacing it in one step."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(data, fh)
+        os.replace(tmp, path)
+    except OSError:
+        # Non-fatal: caches are just rebuilt next time
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def embed_diff(diff):
+    """Returns a unit-length embedding of a diff, computed locally.
+
+    The vector is a hashed bag of the tokens of the file names and changed
+    lines (with +/- kept apart, and hunk line numbers left out), so diffs
+    that differ only in whitespace, line offsets or a few identifiers end
+    up close. It costs no API call and well under a millisecond per KB.
+    Returns None for a diff without any tokens.
+    """
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    counts = Counter()
+    for line in diff.splitlines():
+        if line.startswith(('--- ', '+++ ')):
+            continue
+        if line.startswith('@@'):
+            # Keep the function context, not the line numbers
+            line = line.split('@@', 2)[-1]
+            sign = '@'
+        else:
+            sign = line[:1] if line[:1] in '+-' else ''
+        counts.update(sign + token for token in EMBEDDING_TOKEN_RE.findall(line))
+    for token, count in counts.items():
+        h = zlib.crc32(token.encode('utf-8'))
+        # The sign bit spreads collisions around zero instead of piling up
+        weight = 1.0 + math.log(count)
+        vector[h % EMBEDDING_DIMENSIONS] += weight if h & 0x80000000 else -weight
+    norm = math.sqrt(sum(v * v for v in vector))
+    if not norm:
+        return None
+    return [round(v / norm, 4) for v in vector]
+
+def load_semantic_cache(path):
+    """Loads the semantic message cache entries (oldest first)."""
+    try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            entries = json.load(fh)
+    except Exception:
+        return []
+    return entries if isinstance(entries, list) else []
+
+def save_semantic_cache(path, entries, entry):
+    """Appends `entry` to the semantic cache, keeping MESSAGE_CACHE_ENTRIES."""
+    entries.append(entry)
+    write_json_atomically(path, entries[-MESSAGE_CACHE_ENTRIES:])
+
+def find_similar_message(entries, embedding, changes, inputs):
+    """Looks up the cached message of a change like the staged one.
+
+    Only entries generated with the same guidelines and context (`inputs`)
+    are considered. Returns (True, entry) for an entry with exactly the same
+    changed lines (`changes`, see digest_diff_lines()), whose message can be
+    proposed as is. Otherwise returns (False, entry) for the closest entry at
+    least SEMANTIC_ADAPT_SIMILARITY similar, whose message is only a starting
+    point for the model, or (False, None). Similarity alone never makes a
+    message reusable: `timeout = 30` changed to 60 or to 10 shares nearly
+    every token. Embeddings are stored with unit length, so the dot product
+    is the cosine similarity.
+    """
+    best, best_entry = SEMANTIC_ADAPT_SIMILARITY, None
+    for entry in entries:
+        if entry.get('inputs') != inputs:
+            continue
+        if entry.get('changes') == changes:
+            return True, entry
+        vector = entry.get('embedding')
+        if not vector or len(vector) != len(embedding):
+            continue
+        similarity = sum(a * b for a, b in zip(embedding, vector))
+        if similarity >= best:
+            best, best_entry = similarity, entry
+    return False, best_entry
+
+def read_loose_head_commit(git_dir, common_dir):
+    """Returns the id and raw message of the HEAD commit, without running git.
+
+    HEAD is resolved through the ref files and the commit is read from its
+    loose object, which is where a commit that was just created lives.
+    Returns None when that isn't possible (packed object, unknown ref
+    storage, ...).
+    """
+    sha = read_head_sha(git_dir, common_dir)
+    if not sha or len(sha) < 3:
+        return None
+    path = os.path.join(common_dir, 'objects', sha[:2], sha[2:])
+    try:
+        with open(path, 'rb') as fh:
+            data = zlib.decompress(fh.read())
+    except (OSError, zlib.error):
+        return None
+    # "commit <size>\0<headers>\n\n<message>"
+    header, _, content = data.partition(b"\0")
+    if not header.startswith(b"commit "):
+        return None
+    return sha, content.partition(b"\n\n")[2]
+
+def read_loose_commit_oneline(git_dir, common_dir):
+    """Formats HEAD like `git log -n 1 --pretty=oneline` without running git.
+
+    Returns None when read_loose_head_commit() can't read HEAD; callers
+    then ask git.
+    """
+    commit = read_loose_head_commit(git_dir, common_dir)
+    if commit is None:
+        return None
+    sha, message = commit
+    # Like %s: the first paragraph, its lines joined with spaces
+    paragraph = message.split(b"\n\n", 1)[0].strip()
+    subject = b" ".join(line.strip() for line in paragraph.split(b"\n"))
+    return f"{sha} {subject.decode('utf-8', errors='replace')}"
+
+def head_oneline(git_dirs=None):
+    """Returns the HEAD commit formatted like `git log -n 1 --pretty=oneline`."""
+    line = read_loose_commit_oneline(*git_dirs) if git_dirs else None
+    return line or run_command(GIT_CMD + ["log", "-n", "1", "--pretty=oneline"])
+
+def lookup_api_key():
+    """Returns the Gemini API key if it is available without prompting.
+
+    The key is looked up in the GOOGLE_API_KEY environment variable and
+    then, if the optional `keyring` package is installed, in the OS keyring.
+    """
+    api_key = os.getenv(API_KEY_ENV_VAR)
+    if api_key:
+        return api_key
+    try:
+        import keyring
+        return keyring.get_password(KEYRING_SERVICE, KEYRING_USERNAME)
+    except Exception:
+        # Not installed, or no usable keyring backend
+        return None
+
+def store_api_key(api_key):
+    """Saves the API key to the OS keyring so later runs don't prompt again."""
+    try:
+        import keyring
+        keyring.set_password(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
+    except Exception:
+        return
+    print("API key saved to the system keyring.")
 
 def get_api_key():
-    """Gets the Gemini API key from environment variables or prompts the user."""
+    """Gets the Gemini API key from the environment or keyring, or prompts the user.
+
+    The key is remembered, so the user is prompted at most once per run. A
+    prompted key is kept for save_prompted_api_key(), so a mistyped key
+    never reaches the keyring. The environment variable is checked every
+    time, so a key exported meanwhile takes over.
+    """
+    global _api_key, _prompted_api_key
     api_key = os.getenv(API_KEY_ENV_VAR)
+    if api_key:
+        return api_key
+    if _api_key:
+        return _api_key
+    api_key = lookup_api_key()
     if not api_key:
         print("Google API Key for Gemini not found in environment variables.")
         try:
@@ -87,112 +615,742 @@ def get_api_key():
         except (EOFError, KeyboardInterrupt):
             print("\nOperation cancelled by user.")
             sys.exit(1)
+        _prompted_api_key = api_key
     if not api_key:
         print("API Key is required to proceed.")
         sys.exit(1)
+    _api_key = api_key
     return api_key
 
+def save_prompted_api_key():
+    """Saves the API key typed at the prompt, once the API has accepted it."""
+    global _prompted_api_key
+    if _prompted_api_key:
+        store_api_key(_prompted_api_key)
+        _prompted_api_key = None
 
-def generate_commit_message(diff, history, context=None, guidelines=None, verbose=False):
-    """Generates a commit message using the Gemini AI.
+def prefetch_client():
+    """Creates the Gemini client if that can be done without prompting.
 
-    Args:
-        diff: The staged git diff output
-        history: The commit history for style reference
-        context: Optional additional context to include in the prompt
-        guidelines: Optional project-specific commit guidelines to follow
-        verbose: Whether to print progress messages
+    Meant to run in a worker thread, where prompting for the API key would
+    interleave with the main thread's output. Returns None otherwise.
     """
-    if verbose:
-        print("🤖 Calling the AI to generate a commit message... (this may take a moment)")
+    if not lookup_api_key():
+        return None
+    return get_client()
 
-    api_key = get_api_key()
-    try:
-        client = genai.Client(api_key=api_key)
-    except Exception as e:
-        print(f"Error configuring Gemini AI: {e}")
-        sys.exit(1)
+def get_client():
+    """Returns the Gemini API client, creating it on first use.
+
+    Creating the client prompts for the API key if needed. The client is
+    reused for as long as the API key stays the same.
+    """
+    global _client, _client_key
+    with _client_lock:
+        load_genai()
+        api_key = get_api_key()
+        if _client is None or _client_key != api_key:
+            try:
+                _client = genai.Client(api_key=api_key)
+            except Exception as e:
+                print(f"Error configuring Gemini AI: {e}")
+                sys.exit(1)
+            _client_key = api_key
+        return _client
 
-    # For this script, we'll use the gemini-3-flash model
+def is_low_signal_file(path):
+    """Check if a diffed file's contents should be left out of the prompt."""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in LOW_SIGNAL_FILES)
 
-    # Build the prompt with optional context and guidelines
-    context_section = ""
-    if context:
-        context_section = f"""
-    **Additional Context (provided by user):**
-    ---
-    {context}
-    ---
+# Ends the diff of a file whose changed lines compress_diff() didn't keep
+CHANGES_NOT_READ_MARKER = b"... (diff too large, changed lines not read) ..."
 
+def water_fill(sizes, budget):
+    """Splits `budget` among items of the given `sizes`, returning the quotas.
+
+    Items smaller than an equal share get all they need, and what they
+    don't use is split among the larger ones.
+    """
+    quotas = list(sizes)
+    if sum(sizes) > budget:
+        remaining = budget
+        order = sorted(range(len(sizes)), key=sizes.__getitem__)
+        for n, i in enumerate(order):
+            share = remaining // (len(order) - n)
+            quotas[i] = min(sizes[i], share)
+            remaining -= quotas[i]
+    return quotas
+
+def truncate_file_diff(lines, quota):
+    """Trims the diff lines of one file to about `quota` bytes.
+
+    The file header and every hunk header are kept, so the model still sees
+    all the places that changed; the changed lines of the hunks share what
+    is left of the quota and a marker says how many were omitted from each.
+    Files with too many hunks to even list are cut at the quota instead.
+    """
+    header = []
+    hunks = []
+    for line in lines:
+        if line.startswith(b'@@'):
+            hunks.append([line])
+        elif hunks:
+            hunks[-1].append(line)
+        else:
+            header.append(line)
+
+    fixed = sum(len(l) + 1 for l in header) + sum(len(hunk[0]) + 1 for hunk in hunks)
+    if fixed > quota:
+        out = []
+        used = 0
+        for count, line in enumerate(lines):
+            used += len(line) + 1
+            if used > quota:
+                break
+            out.append(line)
+        out.append(f"... truncated {len(lines) - count} lines ...".encode())
+        return out
+
+    out = header
+    sizes = [sum(len(l) + 1 for l in hunk[1:]) for hunk in hunks]
+    for hunk, hunk_quota in zip(hunks, water_fill(sizes, quota - fixed)):
+        out.append(hunk[0])
+        used = 0
+        kept = 0
+        for line in hunk[1:]:
+            used += len(line) + 1
+            if used > hunk_quota:
+                break
+            out.append(line)
+            kept += 1
+        if kept < len(hunk) - 1:
+            out.append(f"... ({len(hunk) - 1 - kept} lines omitted) ...".encode())
+    return out
+
+def compress_diff(diff_lines, budget=DIFF_BUDGET_BYTES, limit=None):
+    """Reduces a staged diff to the parts worth sending to the model.
+
+    Low-signal files (see LOW_SIGNAL_FILES) and binary files are replaced by
+    a one-line note. Of the remaining files only the headers, hunk headers
+    and changed lines are kept; context lines and `index` lines are dropped.
+    If the result is still over `budget` bytes, every file is trimmed to an
+    equal share of the budget (small files are kept whole, see water_fill())
+    by truncate_file_diff().
+
+    Takes the raw `git diff` output lines as bytes and consumes them one at
+    a time, so it can be fed straight from a pipe; only the surviving lines
+    are decoded. When `limit` is given, once that many bytes have been kept
+    the changed lines of the rest of the diff are dropped (and past twice
+    that, the hunk headers too), with a marker in each file concerned, so
+    that every file still gets its share of the budget.
     """
+    files = []
+    skipped = []
+    lines = None
+    in_hunks = False
+    kept = 0
+    dropped = False
+    for line in diff_lines:
+        line = line.rstrip(b'\r\n')
+        headers_only = limit is not None and kept > limit
+        if line.startswith(b'diff --git '):
+            if dropped:
+                lines.append(CHANGES_NOT_READ_MARKER)
+            lines = []
+            in_hunks = False
+            dropped = False
+            files.append(lines)
+        elif lines is None:
+            continue
+        elif line.startswith(b'@@'):
+            in_hunks = True
+            if headers_only and kept > 2 * limit:
+                dropped = True
+                continue
+        elif in_hunks and not line.startswith((b'+', b'-')):
+            continue
+        elif not in_hunks and line.startswith(b'index '):
+            continue
+        elif in_hunks and headers_only:
+            dropped = True
+            continue
+        lines.append(line)
+        kept += len(line) + 1
+    if dropped:
+        lines.append(CHANGES_NOT_READ_MARKER)
+
+    kept_files = []
+    for lines in files:
+        path = lines[0].rsplit(b' b/', 1)[-1].decode('utf-8', errors='replace')
+        if is_low_signal_file(path) or any(l.startswith(b'Binary files ') for l in lines[1:]):
+            skipped.append(path)
+        else:
+            kept_files.append(lines)
+
+    sizes = [sum(len(l) + 1 for l in lines) for lines in kept_files]
+    out = []
+    for lines, size, quota in zip(kept_files, sizes, water_fill(sizes, budget)):
+        if size <= quota:
+            out.extend(lines)
+        else:
+            out.extend(truncate_file_diff(lines, quota))
+    if skipped:
+        out.append(("Contents omitted (lockfiles, generated or binary files): " + ", ".join(skipped)).encode())
+    return b"\n".join(out).decode('utf-8', errors='replace')
 
-    guidelines_section = ""
-    if guidelines:
-        guidelines_section = f"""
-    **Project Commit Guidelines (to follow):**
-    ---
-    {guidelines}
-    ---
+def timed_input(prompt, timeout, default):
+    """Like input(), but returns `default` if nothing is typed in `timeout` seconds.
 
+    Where stdin can't be polled (e.g. on Windows) this blocks like input().
+    """
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    try:
+        ready, _, _ = select.select([sys.stdin], [], [], timeout)
+    except (OSError, ValueError):
+        return input()
+    if not ready:
+        print(f"\nNo answer after {timeout} seconds, assuming '{default}'.")
+        return default
+    line = sys.stdin.readline()
+    if not line:
+        raise EOFError
+    return line.rstrip('\n')
+
+def summarize_history(subjects, project_prefixes=None):
+    """Condenses commit subjects into a short style descriptor for the prompt.
+
+    Sending a few lines of statistics (Conventional Commits types in use,
+    subject length, imperative mood) plus a handful of verbatim examples
+    costs far fewer tokens than the raw subjects and describes the style
+    just as well. `project_prefixes` are the most common prefixes from a
+    full history analysis, when one is available.
+    """
+    subjects = [s.strip() for s in subjects if s.strip()]
+    if not subjects:
+        return "No previous commits found. This is likely the initial commit."
+
+    type_counts = Counter()
+    scoped = 0
+    imperative = 0
+    for subject in subjects:
+        m = CONVENTIONAL_PREFIX_RE.match(subject)
+        if m:
+            type_counts[m.group(1)] += 1
+            scoped += m.group(2) is not None
+            subject = subject[m.end():].lstrip()
+        elif ':' in subject:
+            subject = subject.rsplit(':', 1)[1].lstrip()
+        imperative += not NON_IMPERATIVE_RE.match(subject)
+    lengths = [len(s) for s in subjects]
+
+    lines = [
+        f"conventional_types: {json.dumps(dict(type_counts.most_common()))} "
+        f"({type_counts.total()} of {len(subjects)} subjects, {scoped} with a scope)",
+        f"subject_length: median {statistics.median(lengths):g}, max {max(lengths)}",
+        f"imperative_mood: {'yes' if imperative * 2 >= len(subjects) else 'no'}",
+    ]
+    if project_prefixes:
+        lines.append("project_prefixes: " + ", ".join(project_prefixes[:5]))
+    lines.append("examples:")
+    lines.extend(subjects[:HISTORY_EXAMPLES])
+    return "\n".join(lines)
+
+def is_comment_line(line, style):
+    """Returns whether `line` looks like nothing but a comment in `style`.
+
+    This only looks at the line itself, which may well be part of a string;
+    code_tokens() has the final say.
+    """
+    stripped = line.strip()
+    if style == '#':
+        return stripped.startswith('#') and not stripped.startswith('#!')
+    if style == 'c' and stripped.startswith('//'):
+        return True
+    if '*/' in stripped and not stripped.endswith('*/'):
+        # Code after the end of the comment
+        return False
+    return stripped.startswith('/*') or stripped in ('*', '*/') or stripped.startswith('* ')
+
+def code_tokens(path, text):
+    """Returns the tokens of source file `text`, leaving out its comments.
+
+    Two versions of a file with the same tokens only differ in comments
+    (and whitespace between tokens). Returns None for files of other types
+    than COMMENT_STYLES lists, and for Python that doesn't tokenize.
+    """
+    style = COMMENT_STYLES.get(os.path.splitext(path)[1].lower())
+    if style == '#':
+        import io
+        import tokenize
+        try:
+            return [
+                (token.type, token.string)
+                for token in tokenize.generate_tokens(io.StringIO(text).readline)
+                if token.type not in (tokenize.COMMENT, tokenize.NL)
+            ]
+        except (tokenize.TokenError, SyntaxError):
+            return None
+    if style in ('c', 'css'):
+        # CSS has no // comments: there the rest of the line is kept as is
+        comments = ('/*',) if style == 'css' else ('/*', '//')
+        return [m.group() for m in C_TOKEN_RE.finditer(text) if not m.group().startswith(comments)]
+    return None
+
+def declared_versions(path, text):
+    """Returns the package versions declared by manifest file `text`.
+
+    Covers package.json, pyproject.toml and Cargo.toml package tables,
+    setup.cfg metadata, setup() calls in setup.py and module-level
+    `__version__` assignments in Python files. Dependency versions and
+    other `version` keys are left out. Returns an empty set for other
+    files and for files that don't parse.
     """
+    name = os.path.basename(path)
+    versions = set()
+    try:
+        if name == 'package.json':
+            data = json.loads(text)
+            versions.add(data.get('version'))
+        elif name in ('pyproject.toml', 'Cargo.toml'):
+            import tomllib
+            data = tomllib.loads(text)
+            tables = (
+                data.get('project'),
+                data.get('package'),
+                data.get('tool', {}).get('poetry'),
+                data.get('workspace', {}).get('package'),
+            )
+            versions.update(t.get('version') for t in tables if isinstance(t, dict))
+        elif name == 'setup.cfg':
+            import configparser
+            parser = configparser.ConfigParser(interpolation=None)
+            parser.read_string(text)
+            versions.add(parser.get('metadata', 'version', fallback=None))
+        elif name.endswith('.py'):
+            import ast
+            tree = ast.parse(text)
+            for node in tree.body:
+                if (isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant)
+                        and any(getattr(t, 'id', None) == '__version__' for t in node.targets)):
+                    versions.add(node.value.value)
+            if name == 'setup.py':
+                for node in ast.walk(tree):
+                    func = getattr(node, 'func', None)
+                    if isinstance(node, ast.Call) and getattr(func, 'id', getattr(func, 'attr', None)) == 'setup':
+                        versions.update(
+                            kw.value.value for kw in node.keywords
+                            if kw.arg == 'version' and isinstance(kw.value, ast.Constant)
+                        )
+    except Exception:
+        # Malformed (or mid-edit) file: not a version bump we can vouch for
+        return set()
+    versions.discard(None)
+    return versions
+
+def read_staged_versions(paths):
+    """Returns {path: (HEAD text, staged text)} for the given files.
+
+    Both versions of every file are read with a single `git cat-file
+    --batch`. Files missing on either side, or that aren't UTF-8, are left
+    out.
+    """
+    revs = [rev for path in paths if '\n' not in path for rev in (f"HEAD:{path}", f":{path}")]
+    try:
+        result = subprocess.run(
+            GIT_CMD + ["cat-file", "--batch"],
+            input="".join(rev + "\n" for rev in revs).encode('utf-8'),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return {}
+    out = result.stdout
+    blobs = {}
+    pos = 0
+    for rev in revs:
+        # "<oid> <type> <size>\n<content>\n" or "<rev> missing\n"
+        end = out.find(b"\n", pos)
+        if end < 0:
+            break
+        header = out[pos:end].split()
+        pos = end + 1
+        if len(header) == 3 and header[1] == b'blob':
+            size = int(header[2])
+            blobs[rev] = out[pos:pos + size]
+            pos += size + 1
+    versions = {}
+    for path in paths:
+        try:
+            versions[path] = (blobs[f"HEAD:{path}"].decode('utf-8'), blobs[f":{path}"].decode('utf-8'))
+        except (KeyError, UnicodeDecodeError):
+            continue
+    return versions
+
+def staged_whitespace_only():
+    """Asks git whether the staged changes only touch trailing whitespace
+    and blank lines (which the compressed diff, lacking context lines,
+    can't tell for sure)."""
+    try:
+        result = subprocess.run(
+            GIT_CMD + ["diff", "--staged", "--quiet", "--ignore-space-at-eol", "--ignore-blank-lines"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return False
+    return result.returncode == 0
+
+def trivial_commit_message(diff, confirm_whitespace=staged_whitespace_only,
+                           read_versions=read_staged_versions):
+    """Returns a template commit message for trivial diffs, or None.
+
+    Trailing whitespace and blank line changes, comment-only changes and
+    single-line version bumps don't need a round trip to the model. `diff`
+    is the compressed diff from read_staged_diff(); diffs that were
+    truncated, touch skipped files, or add, delete, rename or chmod files
+    are never considered trivial. Leading indentation is significant, and
+    whitespace changes are matched line by line within each hunk and then
+    confirmed with `confirm_whitespace()`.
+
+    The diff has no context lines, so version bumps and comment changes
+    are confirmed against both versions of the files, from
+    `read_versions(paths)` (see read_staged_versions()). When in doubt,
+    None is returned and the model writes the message.
+    """
+    files = []
+    hunks = []
+    in_hunks = False
+    for line in diff.splitlines():
+        if line.startswith('diff --git '):
+            files.append(line.rsplit(' b/', 1)[-1])
+            in_hunks = False
+        elif line.startswith('@@'):
+            in_hunks = True
+            hunks.append((files[-1], [], []))
+        elif in_hunks and line.startswith('-'):
+            hunks[-1][1].append(line[1:])
+        elif in_hunks and line.startswith('+'):
+            hunks[-1][2].append(line[1:])
+        elif in_hunks or not files or not line.startswith(('--- ', '+++ ')):
+            # Truncation/omission markers, or a file mode/rename header
+            return None
+    if not any(removed or added for _, removed, added in hunks):
+        return None
+
+    where = files[0] if len(files) == 1 else f"{len(files)} files"
+
+    def significant(lines):
+        return [line.rstrip() for line in lines if line.strip()]
+    if all(significant(removed) == significant(added) for _, removed, added in hunks):
+        if confirm_whitespace():
+            return f"style: fix whitespace in {where}"
+        return None
+
+    if len(files) == 1 and len(hunks) == 1 and len(hunks[0][1]) == 1 and len(hunks[0][2]) == 1:
+        removed, added = hunks[0][1][0], hunks[0][2][0]
+        old = VERSION_LINE_RE.match(removed)
+        new = VERSION_LINE_RE.match(added)
+        if (old and new and old.group(3) != new.group(3)
+                and VERSION_VALUE_RE.match(old.group(3)) and VERSION_VALUE_RE.match(new.group(3))
+                and removed.replace(old.group(3), new.group(3)) == added):
+            texts = read_versions(files).get(files[0])
+            if (texts and old.group(3) in declared_versions(files[0], texts[0])
+                    and new.group(3) in declared_versions(files[0], texts[1])):
+                return f"chore: bump version to {new.group(3)}"
+            return None
+
+    for path, removed, added in hunks:
+        style = COMMENT_STYLES.get(os.path.splitext(path)[1].lower())
+        if not style:
+            return None
+        for line in removed + added:
+            if line.strip() and not is_comment_line(line, style):
+                return None
+    versions = read_versions(files)
+    for path in files:
+        texts = versions.get(path)
+        if not texts:
+            return None
+        old_tokens = code_tokens(path, texts[0])
+        if old_tokens is None or old_tokens != code_tokens(path, texts[1]):
+            return None
+    return f"docs: update comments in {where}"
+
+def digest_diff_lines(lines, fingerprint, changes):
+    """Yields the lines (bytes) of a git diff while hashing them.
+
+    `fingerprint` is fed all the lines but `index` ones (blob ids), without
+    trailing whitespace, so that the same change staged again hashes the
+    same. `changes` is only fed the file headers and the added and removed
+    lines, so it stays the same when the hunks move or their context
+    changes, and differs as soon as one changed line does.
+    """
+    in_header = False
+    for line in lines:
+        if line.startswith(b'diff --git '):
+            in_header = True
+        elif line.startswith(b'@@'):
+            in_header = False
+        if not line.startswith(b'index '):
+            line_key = line.rstrip() + b'\n'
+            fingerprint.update(line_key)
+            if in_header or line[:1] in (b'+', b'-'):
+                changes.update(line_key)
+        yield line
+
+def read_staged_diff():
+    """Reads `git diff --staged` through compress_diff() as git writes it.
+
+    The output is never buffered whole: lines are filtered as they come off
+    the pipe, and past DIFF_READ_LIMIT_BYTES only headers are kept.
+
+    Returns the compressed diff (an empty string when nothing is staged) and
+    two digests of the full diff, from digest_diff_lines(): its fingerprint
+    and the hash of its changed lines.
+    """
+    digest = hashlib.sha256()
+    changes = hashlib.sha256()
+
+    import tempfile
+    command = GIT_CMD + ["diff", "--staged"]
+    # stderr goes to a file rather than a second pipe: git may write more
+    # warnings (CRLF, ...) than a pipe holds while stdout is still being
+    # read, and would block on it forever.
+    with tempfile.TemporaryFile() as errors:
+        try:
+            proc = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+                bufsize=1 << 20,
+            )
+        except FileNotFoundError:
+            print(f"Error executing command: `{shlex.join(command)}`")
+            print(f"Command not found: {command[0]}")
+            sys.exit(1)
+        with proc:
+            diff = compress_diff(
+                digest_diff_lines(proc.stdout, digest, changes), limit=DIFF_READ_LIMIT_BYTES
+            )
+        if proc.returncode != 0:
+            errors.seek(0)
+            print(f"Error executing command: `{shlex.join(command)}`")
+            print(f"Stderr: {decode_output(errors.read())}")
+            sys.exit(1)
+    return diff, digest.hexdigest(), changes.hexdigest()
 
-    prompt = f"""
-    You are an expert programmer and git user. Your task is to write a clear, concise, and conventional commit message.
+def fetch_url(url, timeout=10):
+    """Downloads `url` and returns its body as text.
 
-    Analyze the following 'git diff --staged' output and the recent commit history to understand the context and the project's conventions.
+    Network errors are raised as URLError (or OSError) for the caller to
+    report.
+    """
+    # Imported here: urllib.request (http.client, email, ...) is the
+    # costliest import of the script and only needed for URL guidelines
+    import urllib.request
+    with urllib.request.urlopen(url, timeout=timeout) as resp:
+        return resp.read().decode('utf-8', errors='replace')
+
+def get_user_cache_dir():
+    """Returns the per-user cache directory (~/.cache/ai-commit by default)."""
+    base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ai-commit')
 
-    **Recent Commit History (for style reference):**
-    ---
-    {history}
-    ---
+def load_cached_content_index():
+    """Loads the map of prompt-prefix hashes to Gemini context cache handles.
 
-    **Staged Changes (git diff):**
-    ---
-    {diff}
-    ---
-{guidelines_section}
-{context_section}
-    **Instructions:**
-    1. Write a commit message that accurately summarizes the changes.
-    2. Follow the conventional commit format if it seems to be used in the history (e.g., `feat:`, `fix:`, `refactor:`, `docs:`, `chore:`).
-    3. When project-specific guidelines are provided, ensure the message follows them closely.
-    4. Keep each line under 100 characters. This applies to the subject line and all body lines.
-    5. After the subject, add a blank line, followed by a more detailed body explaining the 'what' and 'why' of the changes if necessary.
-    6. Do not include any introductory text like "Here is the commit message:". Just provide the raw commit message.
+    Malformed files and entries are ignored, like expired ones.
     """
+    path = os.path.join(get_user_cache_dir(), 'cached_content.json')
     try:
+        with open(path, 'r', encoding='utf-8') as fh:
+            index = json.load(fh)
+    except Exception:
+        return {}
+    if not isinstance(index, dict):
+        return {}
+    # Drop expired handles and refusals that are due for a retry
+    now = datetime.datetime.now(datetime.UTC)
+    valid = {}
+    for key, entry in index.items():
+        try:
+            if datetime.datetime.fromisoformat(entry['expires_at']) > now:
+                valid[key] = {'name': entry.get('name'), 'expires_at': entry['expires_at']}
+        except (TypeError, KeyError, ValueError, AttributeError):
+            continue
+    return valid
+
+def save_cached_content_index(index):
+    """Writes the context cache handle index back to the user cache dir."""
+    path = os.path.join(get_user_cache_dir(), 'cached_content.json')
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    except OSError:
+        # Non-fatal: the cache just won't be reused by the next run
+        return
+    write_json_atomically(path, index)
+
+def get_cached_content(client, system_instruction, prefix=""):
+    """Returns the name of a Gemini context cache holding the prompt prefix.
+
+    The cache holds `system_instruction` and, if given, `prefix` as the
+    first turn of the conversation. Cache handles are remembered in
+    ~/.cache/ai-commit/cached_content.json, keyed by a hash of the model and
+    the cached text, so later runs reuse them until they expire and a change
+    of the text gets a new cache. Returns None when the prefix is too small
+    to be cached or the API refuses to cache it; the caller then sends it
+    inline.
+    """
+    if len(system_instruction) + len(prefix) < CACHE_MIN_CHARS:
+        return None
+
+    key = hashlib.sha256(
+        f"{MODEL_NAME}\0{system_instruction}\0{prefix}".encode('utf-8')
+    ).hexdigest()
+    index = load_cached_content_index()
+    if key not in index:
+        now = datetime.datetime.now(datetime.UTC)
+        try:
+            cache = client.caches.create(
+                model=MODEL_NAME,
+                config=types.CreateCachedContentConfig(
+                    display_name='ai-commit',
+                    system_instruction=system_instruction,
+                    contents=[prefix] if prefix else None,
+                    ttl=f"{CACHE_TTL_SECONDS}s",
+                ),
+            )
+            # Stop using the handle a minute early so it can't expire mid-request
+            expires_at = now + datetime.timedelta(seconds=CACHE_TTL_SECONDS - 60)
+            index[key] = {'name': cache.name, 'expires_at': expires_at.isoformat()}
+        except Exception as e:
+            if not is_request_rejected(e):
+                # Network trouble and the like: try again next time
+                return None
+            expires_at = now + datetime.timedelta(seconds=CACHE_RETRY_SECONDS)
+            index[key] = {'name': None, 'expires_at': expires_at.isoformat()}
+        save_cached_content_index(index)
+    return index[key]['name']
+
+def is_request_rejected(error):
+    """Returns whether a Gemini API call failed because the API rejected it.
+
+    The SDK's client errors carry the HTTP status as `code`. A 400, 403 or
+    404 means the request itself won't do (a cache that is gone, belongs to
+    another API key or can't be created); anything else (network errors,
+    rate limits, server errors) would fail again right away.
+    """
+    return getattr(error, 'code', None) in (400, 403, 404)
+
+def forget_cached_content(name):
+    """Drops a context cache handle that the API no longer accepts."""
+    index = load_cached_content_index()
+    save_cached_content_index({k: v for k, v in index.items() if v['name'] != name})
+
+
+def request_completion(client, prompt, config, stream=False, parts=None):
+    """Sends `prompt` to the model and returns the generated text.
+
+    With stream=True the text is echoed to stdout as it arrives, so the user
+    starts reading after the first token rather than the last one. The
+    echoed chunks are collected in `parts`, if given, so callers can tell
+    whether anything was printed before an error.
+    """
+    if not stream:
         response = client.models.generate_content(
-            model='gemini-3-flash-preview', contents=prompt
+            model=MODEL_NAME, contents=prompt, config=config
         )
-        return response.text.strip()
-    except Exception as e:
+        return response.text
+
+    if parts is None:
+        parts = []
+    for chunk in client.models.generate_content_stream(
+        model=MODEL_NAME, contents=prompt, config=config
+    ):
+        if chunk.text:
+            sys.stdout.write(chunk.text)
+            sys.stdout.flush()
+            parts.append(chunk.text)
+    return "".join(parts)
+
+
+def generate_commit_message(diff, history, context=None, guidelines=None, stream=False, client=None,
+                            previous_message=None):
+    """Generates a commit message using the Gemini AI.
+
+    Args:
+        diff: The compressed staged diff, as returned by read_staged_diff()
+        history: The commit history style summary (see summarize_history())
+        context: Optional additional context to include in the prompt
+        guidelines: Optional project-specific commit guidelines to follow
+        stream: Whether to echo the message to stdout while it is generated
+        client: Optional Gemini client (defaults to get_client())
+        previous_message: Optional message of a similar change, which the
+            model is asked to adapt instead of writing one from the history
+    """
+    if client is None:
+        client = get_client()
+    load_genai()
+
+    # Build the prompt with optional context and guidelines. The guidelines
+    # go first: like the instructions they're the same for every commit.
+    prefix = GUIDELINES_SECTION_TEMPLATE.format_map({'guidelines': guidelines}) if guidelines else ""
+    fields = {
+        'history': history,
+        'previous_message': previous_message,
+        'diff': diff,
+        'context_section': CONTEXT_SECTION_TEMPLATE.format_map({'context': context}) if context else "",
+    }
+    template = ADAPT_PROMPT_TEMPLATE if previous_message else PROMPT_TEMPLATE
+    prompt = template.format_map(fields)
+
+    # Serve the instructions and guidelines from a context cache when one
+    # is available, so that only the per-commit part is sent and billed in
+    # full, and send them inline otherwise.
+    def api_error(e):
         print(f"An error occurred while communicating with the Gemini API: {e}")
         print("Please check your API key and network connection.")
         sys.exit(1)
 
+    cached_content = get_cached_content(client, SYSTEM_INSTRUCTIONS, prefix)
+    if cached_content:
+        streamed = []
+        try:
+            return request_completion(
+                client,
+                prompt,
+                types.GenerateContentConfig(cached_content=cached_content),
+                stream=stream,
+                parts=streamed,
+            ).strip()
+        except Exception as e:
+            # Retry inline only if the cache was the problem (expired early
+            # or created with another API key): the inline request would
+            # fail the same way otherwise. Nor after part of the message
+            # was streamed, which would print it again after the partial one.
+            if streamed:
+                print()
+            if streamed or not is_request_rejected(e):
+                api_error(e)
+            forget_cached_content(cached_content)
+
+    try:
+        return request_completion(
+            client,
+            prefix + prompt,
+            types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTIONS),
+            stream=stream,
+        ).strip()
+    except Exception as e:
+        api_error(e)
+
 
 # --- Main Logic ---
 
-def main():
-    """Main function to run the commit message generator."""
-    # If the user asked for help, prefer opening the manual page for the
-    # installed git-ai-commit man file (so `git ai-commit --help` behaves like
-    # `man git-ai-commit`). Do this before argparse parses args.
-    cli_args = sys.argv[1:]
-    if any(a in ('-h', '--help') for a in cli_args):
-        # Try to open the man page `git-ai-commit` first. This will use the
-        # user's pager (less/man) and provide the full manual.
-        try:
-            subprocess.run(["man", "git-ai-commit"])
-            sys.exit(0)
-        except FileNotFoundError:
-            # 'man' not available on this system
-            print("Note: 'man' command not found. Please install man or view 'man/git-ai-commit.1' in this repo.")
-            sys.exit(0)
-        except subprocess.CalledProcessError:
-            # man ran but returned non-zero (page may not be installed)
-            print("Manual page 'git-ai-commit' not installed. See man/git-ai-commit.1 in this repository for the manual.")
-            sys.exit(0)
+def build_parser():
+    """Builds the command line parser (defaults come from CLI_DEFAULTS)."""
     parser = argparse.ArgumentParser(
         description="AI-powered commit message generator for Git",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -231,19 +1389,17 @@ Notes:
     parser.add_argument(
         "--analyze",
         action="store_true",
-        help="Analyze project commit history and write a style cache to .git/ai-commit-style.json"
+        help="Analyze project commit history and write a style cache to .git/ai-commit-style.msgpack (.json without msgpack)"
     )
     parser.add_argument(
         "--history-depth",
         type=int,
-        default=1000,
         help="Number of commits to analyze when creating the style cache (default: 1000)"
     )
     parser.add_argument(
         "--cache-file",
         type=str,
-        default=os.path.join('.git', 'ai-commit-style.json'),
-        help="Path to cache file (default: .git/ai-commit-style.json)"
+        help="Path to cache file (default: .git/ai-commit-style.msgpack, or .json without msgpack)"
     )
     parser.add_argument(
         "--force-analyze",
@@ -253,24 +1409,59 @@ Notes:
     parser.add_argument(
         "--context",
         type=str,
-        default=None,
         help="Additional context to pass to the AI for generating the commit message (e.g., 'fixes the following build error')"
     )
     parser.add_argument(
         "--guidelines",
         type=str,
-        default=None,
         help="Project commit guidelines (inline text, local file path, or http(s) URL). When provided, guidelines are cached automatically for this repository."
     )
+    parser.add_argument(
+        "--force-ai",
+        action="store_true",
+        help="Always ask the AI, even for trivial changes (whitespace, comments, version bumps) that otherwise get a template message"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ask the AI again instead of reusing the message generated earlier for the same staged changes"
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
         help="Show progress messages and confirmations (default is quiet mode, which opens the editor directly)"
     )
+    parser.set_defaults(**CLI_DEFAULTS)
+    return parser
+
 
+def main():
+    """Main function to run the commit message generator."""
+    # If the user asked for help, prefer opening the manual page for the
+    # installed git-ai-commit man file (so `git ai-commit --help` behaves like
+    # `man git-ai-commit`). Do this before argparse parses args.
+    cli_args = sys.argv[1:]
+    if any(a in ('-h', '--help') for a in cli_args):
+        # Try to open the man page `git-ai-commit` first. This will use the
+        # user's pager (less/man) and provide the full manual.
+        try:
+            subprocess.run(["man", "git-ai-commit"])
+            sys.exit(0)
+        except FileNotFoundError:
+            # 'man' not available on this system
+            print("Note: 'man' command not found. Please install man or view 'man/git-ai-commit.1' in this repo.")
+            sys.exit(0)
+        except subprocess.CalledProcessError:
+            # man ran but returned non-zero (page may not be installed)
+            print("Manual page 'git-ai-commit' not installed. See man/git-ai-commit.1 in this repository for the manual.")
+            sys.exit(0)
     # Parse known args (our flags) and capture all other args to forward
-    # directly to the underlying `git commit` command.
-    args, unknown_args = parser.parse_known_args()
+    # directly to the underlying `git commit` command. The common no-flags
+    # invocation doesn't need a parser at all.
+    if cli_args:
+        args, unknown_args = build_parser().parse_known_args(cli_args)
+    else:
+        args, unknown_args = argparse.Namespace(**CLI_DEFAULTS), []
 
     # Helper to conditionally print based on verbose mode
     def vprint(*args_to_print, **kwargs):
@@ -279,24 +1470,58 @@ Notes:
 
     vprint("🚀 Starting AI Commit Assistant...")
 
-    if not is_git_repository():
-        print("Error: This is not a git repository.")
+    git_dirs = get_git_dirs()
+    if git_dirs is None:
+        print("Error: This is not inside the work tree of a git repository.")
         print("Usage: git ai-commit [--auto-commit] [--dry-run]")
         sys.exit(1)
+    git_dir, common_dir = git_dirs
+    if args.cache_file is None:
+        # Shared by all worktrees of the repository
+        try:
+            import msgpack  # noqa: F401
+            ext = '.msgpack'
+        except ImportError:
+            ext = '.json'
+        args.cache_file = os.path.join(common_dir, 'ai-commit-style' + ext)
 
     # Helper for caching/analyzing project commit history
+    # The style cache is written with msgpack when the optional module is
+    # installed (cheaper to parse with a large profile and guidelines), and
+    # as JSON otherwise; the format follows the file extension. A .msgpack
+    # cache that doesn't exist yet falls back to the .json one next to it,
+    # so a JSON profile and its guidelines carry over once msgpack is
+    # installed. Loading sniffs the format, so either file works.
     def load_style_cache(path):
-        try:
-            with open(path, 'r', encoding='utf-8') as fh:
-                return json.load(fh)
-        except Exception:
-            return None
+        paths = [path]
+        root, ext = os.path.splitext(path)
+        if ext == '.msgpack':
+            paths.append(root + '.json')
+        for candidate in paths:
+            try:
+                with open(candidate, 'rb') as fh:
+                    data = fh.read()
+            except OSError:
+                continue
+            try:
+                if data.lstrip()[:1] == b'{':
+                    return json.loads(data)
+                import msgpack
+                return msgpack.unpackb(data, raw=False)
+            except Exception:
+                continue
+        return None
 
     def save_style_cache(path, profile):
         try:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'w', encoding='utf-8') as fh:
-                json.dump(profile, fh, indent=2, ensure_ascii=False)
+            if path.endswith('.msgpack'):
+                import msgpack
+                data = msgpack.packb(profile, use_bin_type=True)
+            else:
+                data = json.dumps(profile, indent=2, ensure_ascii=False).encode('utf-8')
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(data)
             return True
         except Exception as e:
             print(f"Could not write cache file {path}: {e}")
@@ -305,34 +1530,63 @@ Notes:
     def analyze_repo(history_depth, cache_file):
         # Read commit subjects up to history_depth and generate a small profile
         print(f"🔎 Analyzing last {history_depth} commits to build style profile...")
+        # Resolved before reading the log, so a commit made meanwhile can
+        # only make the profile look stale, never up to date
+        head_sha = read_head_sha(git_dir, common_dir)
+
+        # The subjects are processed as git produces them, so memory use
+        # doesn't grow with the depth and the analysis overlaps git's work.
+        # Records are NUL-separated bytes; only the kept examples and the
+        # subjects that aren't plain ASCII get decoded. A repository without
+        # commits simply yields no subjects.
+        prefixes = Counter()
+        count = 0
+        total_len = 0
+        examples = []
         try:
-            raw = run_command(f"git log -n {history_depth} --pretty=format:%s")
-        except SystemExit:
-            raw = ''
-        subjects = [s for s in raw.splitlines() if s.strip()]
-        count = len(subjects)
-
-        # Detect conventional prefixes like 'feat:', 'fix:'
-        prefix_re = re.compile(r'^(?P<prefix>[A-Za-z0-9_-]+):')
-        prefixes = {}
-        for s in subjects:
-            m = prefix_re.match(s)
-            if m:
-                p = m.group('prefix')
-                prefixes[p] = prefixes.get(p, 0) + 1
-
-        sorted_prefixes = sorted(prefixes.items(), key=lambda x: x[1], reverse=True)
-        top_prefixes = [p for p, _ in sorted_prefixes[:10]]
-
-        avg_len = float(sum(len(s) for s in subjects) / count) if count > 0 else 0.0
+            proc = subprocess.Popen(
+                GIT_CMD + ["log", "-z", "-n", str(history_depth), "--pretty=format:%s"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            proc = None
+        if proc is not None:
+            with proc:
+                pending = b''
+                while True:
+                    chunk = proc.stdout.read(1 << 16)
+                    records = (pending + chunk).split(b'\0')
+                    # The last record may continue in the next chunk
+                    pending = records.pop() if chunk else b''
+                    for s in records:
+                        if not s.strip():
+                            continue
+                        count += 1
+                        total_len += len(s) if s.isascii() else len(s.decode('utf-8', errors='replace'))
+                        if len(examples) < 25:
+                            examples.append(s.decode('utf-8', errors='replace'))
+
+                        # Detect conventional prefixes like 'feat:', 'fix:'
+                        m = SUBJECT_PREFIX_RE.match(s)
+                        if m:
+                            prefixes[m.group(1).decode('ascii')] += 1
+                    if not chunk:
+                        break
+
+        top_prefixes = [p for p, _ in prefixes.most_common(10)]
+
+        avg_len = float(total_len / count) if count > 0 else 0.0
 
         profile = {
             'created_at': datetime.datetime.now(datetime.UTC).isoformat().replace('+00:00', 'Z'),
             'commit_count_scanned': count,
-            'history_examples': subjects[:25],
+            'history_examples': examples,
             'detected_types': prefixes,
             'top_prefixes': top_prefixes,
             'avg_subject_len': avg_len,
+            'head_sha': head_sha,
+            'history_depth': history_depth,
         }
 
         saved = save_style_cache(cache_file, profile)
@@ -341,46 +1595,108 @@ Notes:
         return profile
 
     # If user asked to analyze, do it now and exit
+    # (unless the profile was built from the same HEAD and depth)
     if args.analyze:
-        analyze_repo(args.history_depth, args.cache_file)
+        profile = load_style_cache(args.cache_file)
+        if (profile and profile.get('head_sha')
+                and profile['head_sha'] == read_head_sha(git_dir, common_dir)
+                and profile.get('history_depth') == args.history_depth):
+            vprint(f"✅ Style profile in {args.cache_file} is up to date")
+        else:
+            analyze_repo(args.history_depth, args.cache_file)
         sys.exit(0)
 
-    # 1. Get the staged diff
+    profile = None
+    if not args.force_analyze:
+        profile = load_style_cache(args.cache_file)
+
+    # The recent commit subjects only change when HEAD moves, so they are
+    # cached keyed by the HEAD commit id. Only needed when no style profile
+    # stands in for them.
+    history_cache = os.path.join(git_dir, 'ai-commit-history-cache')
+    head_sha = None
+    cached_history = None
+    if not profile and not args.force_analyze:
+        head_sha = read_head_sha(git_dir, common_dir)
+        cached_history = load_history_cache(history_cache, head_sha)
+
+    # 1. Get the staged diff. The commit history read (on a cache miss)
+    # doesn't depend on it, so both run concurrently.
     vprint("🔍 Analyzing staged changes...")
-    staged_diff = run_command("git diff --staged")
+    executor = ThreadPoolExecutor(max_workers=4)
+    diff_future = executor.submit(read_staged_diff)
+    log_future = None
+    if not profile and not args.force_analyze and cached_history is None:
+        log_future = executor.submit(
+            run_command, GIT_CMD + ["log", "-n", "10", "--pretty=format:%s"], quiet=True
+        )
+
+    # Download the guidelines while git is busy
+    guidelines_future = None
+    if args.guidelines and args.guidelines.startswith(('http://', 'https://')):
+        guidelines_future = executor.submit(fetch_url, args.guidelines)
+
+    staged_diff, diff_fingerprint, diff_changes = diff_future.result()
     if not staged_diff:
         print("⚠️ No staged changes found.")
         print("Stage your changes first with: git add <files>")
         sys.exit(0)
 
+    # Trivial changes get a template message instead of an AI round trip,
+    # unless the user asked for the AI or gave it something to work with.
+    trivial_message = None
+    if not (args.force_ai or args.context or args.guidelines
+            or (profile and profile.get('commit_guidelines'))):
+        trivial_message = trivial_commit_message(staged_diff)
+
+    # Messages generated earlier are reused when the same changes are
+    # staged again (rebases, amend loops, ...).
+    message_cache_path = os.path.join(git_dir, 'ai-commit-cache.json')
+    semantic_cache_path = os.path.join(git_dir, 'ai-commit-semcache.json')
+    message_cache = {}
+    semantic_cache = []
+    message_key = None
+    cached_entry = None
+    if trivial_message is None:
+        message_cache = load_message_cache(message_cache_path)
+        message_key = message_cache_key(diff_fingerprint)
+        if not args.no_cache:
+            cached_entry = message_cache.get(message_key)
+            semantic_cache = load_semantic_cache(semantic_cache_path)
+
+    # There is something to commit: import the SDK and set up the Gemini
+    # client in the background while the rest of the prompt is prepared,
+    # unless a message made earlier for the same changes will likely do.
+    client_future = None
+    if (trivial_message is None and cached_entry is None
+            and not any(e.get('changes') == diff_changes for e in semantic_cache)):
+        client_future = executor.submit(prefetch_client)
+    executor.shutdown(wait=False)
+
     # 2. Get commit history for context (use cache if available)
     vprint("📚 Preparing commit history context...")
 
-
-
-    profile = None
-    if not args.force_analyze:
-        profile = load_style_cache(args.cache_file)
-
     if profile:
-        examples = profile.get('history_examples', [])
-        detected = profile.get('top_prefixes', [])
-        summary = ''
-        if detected:
-            summary = 'Detected prefixes: ' + ', '.join(detected[:5]) + '\n'
-        commit_history = summary + '\n'.join(examples)
+        commit_history = summarize_history(
+            profile.get('history_examples', []), profile.get('top_prefixes')
+        )
     else:
         if args.force_analyze:
             profile = analyze_repo(args.history_depth, args.cache_file)
-            examples = profile.get('history_examples', [])
-            commit_history = '\n'.join(examples)
+            commit_history = summarize_history(
+                profile.get('history_examples', []), profile.get('top_prefixes')
+            )
+        elif cached_history is not None:
+            commit_history = summarize_history(cached_history.splitlines())
         else:
             try:
-                commit_history = run_command("git log -n 10 --pretty=format:'%s'")
+                subjects = log_future.result()
+                save_history_cache(history_cache, head_sha, subjects)
+                commit_history = summarize_history(subjects.splitlines())
             except SystemExit:
                 # This can happen in a new repo with no commits yet
                 print("Could not retrieve commit history. Assuming this is a new repository.")
-                commit_history = "No previous commits found. This is likely the initial commit."
+                commit_history = summarize_history([])
 
     # 3. Prepare guidelines (inline text, local file path, http(s) URL, or cached) and generate the commit message
     guidelines_text = None
@@ -390,10 +1706,9 @@ Notes:
         raw = args.guidelines
         # Heuristic: treat http(s) URLs as remote resources to fetch
         if raw.startswith('http://') or raw.startswith('https://'):
+            from urllib.error import URLError
             try:
-                with urllib.request.urlopen(raw, timeout=10) as resp:
-                    b = resp.read()
-                    guidelines_text = b.decode('utf-8', errors='replace')
+                guidelines_text = guidelines_future.result()
             except URLError as e:
                 print(f"Could not download guidelines from {raw}: {e}")
                 sys.exit(1)
@@ -429,22 +1744,112 @@ Notes:
     if not guidelines_text and profile and isinstance(profile, dict):
         guidelines_text = profile.get('commit_guidelines')
 
-    suggested_message = generate_commit_message(
-        staged_diff,
-        commit_history,
-        context=args.context,
-        guidelines=guidelines_text,
-        verbose=args.verbose,
-    )
-
-    # In verbose mode, show the message and ask for confirmation
+    # In verbose mode, stream the message under the banner as it is
+    # generated, then ask for confirmation.
     # In quiet mode, auto-open editor (similar to `git commit` behavior)
-    if args.verbose:
-        print("\n" + "="*60)
-        print("✨ AI-Generated Commit Message Suggestion ✨")
-        print("="*60)
-        print(suggested_message)
-        print("="*60)
+    prompt_inputs = prompt_inputs_hash(guidelines_text, args.context)
+    if cached_entry is not None and cached_entry.get('inputs') != prompt_inputs:
+        # Same diff, but other guidelines or context
+        cached_entry = None
+
+    # Messages are only cached once the changes were committed with them, as
+    # edited by the user, so a rejected suggestion isn't proposed again.
+    semantic_entry = None
+
+    def remember_message(message):
+        if trivial_message is not None or not message:
+            return
+        save_message_cache(message_cache_path, message_cache, message_key, {
+            'inputs': prompt_inputs,
+            'message': message,
+        })
+        if semantic_entry:
+            save_semantic_cache(semantic_cache_path, semantic_cache,
+                                dict(semantic_entry, message=message))
+
+    def remember_committed_message():
+        # The message the editor was opened on may have been changed
+        commit = read_loose_head_commit(git_dir, common_dir)
+        if commit:
+            remember_message(commit[1].decode('utf-8', errors='replace').strip())
+
+    suggested_message = None
+    is_cached = False
+    if trivial_message is not None:
+        vprint("⚡ Trivial change detected, using a template message (use --force-ai to ask the AI instead)")
+        suggested_message = trivial_message
+        title = "✨ Suggested Commit Message ✨"
+    elif cached_entry is not None:
+        vprint("♻️ Reusing the message generated earlier for these changes (use --no-cache to ask the AI again)")
+        suggested_message = cached_entry['message']
+        is_cached = True
+        title = "✨ AI-Generated Commit Message Suggestion (cached) ✨"
+    else:
+        # Look for the message of a similar change
+        embedding = None
+        reusable, similar = False, None
+        if not args.no_cache:
+            embedding = embed_diff(staged_diff)
+        if embedding:
+            reusable, similar = find_similar_message(
+                semantic_cache, embedding, diff_changes, prompt_inputs
+            )
+        previous_message = None
+        if reusable:
+            vprint("♻️ Reusing the message of the same changes made earlier (use --no-cache to ask the AI again)")
+            suggested_message = similar['message']
+            is_cached = True
+            title = "✨ AI-Generated Commit Message Suggestion (cached) ✨"
+        elif similar:
+            previous_message = similar['message']
+
+    if suggested_message is not None:
+        if args.verbose:
+            print("\n" + BANNER)
+            print(title)
+            print(BANNER)
+            print(suggested_message)
+            print(BANNER)
+    else:
+        # Create the client (and prompt for the key, if needed) before the banner.
+        # Nothing was prefetched if a cache entry turned out to be for other
+        # guidelines or context.
+        client = (client_future.result() if client_future else None) or get_client()
+
+        if previous_message:
+            vprint("🤖 Asking the AI to adapt the message of a similar earlier change...")
+        else:
+            vprint("🤖 Calling the AI to generate a commit message... (this may take a moment)")
+        if args.verbose:
+            print("\n" + BANNER)
+            print("✨ AI-Generated Commit Message Suggestion ✨")
+            print(BANNER)
+
+        # The message is streamed in verbose mode, so the user may stop a
+        # clearly wrong one early with Ctrl-C; nothing is cached then.
+        try:
+            suggested_message = generate_commit_message(
+                staged_diff,
+                commit_history,
+                context=args.context,
+                guidelines=guidelines_text,
+                stream=args.verbose,
+                client=client,
+                previous_message=previous_message,
+            )
+        except KeyboardInterrupt:
+            print("\n\nOperation cancelled by user.")
+            sys.exit(1)
+        save_prompted_api_key()
+        if embedding:
+            semantic_entry = {
+                'embedding': embedding,
+                'changes': diff_changes,
+                'inputs': prompt_inputs,
+            }
+
+        if args.verbose:
+            print("\n" + BANNER)
 
     # 4. Handle auto-commit, dry-run, or editor flow
     should_commit = args.auto_commit
@@ -467,8 +1872,9 @@ Notes:
                 # Run interactively so the editor has a TTY
                 result = subprocess.run(commit_cmd)
                 if result.returncode == 0:
+                    remember_committed_message()
                     vprint("\n🎉 Commit successful!")
-                    vprint(run_command("git log -n 1 --pretty=oneline"))
+                    vprint(head_oneline(git_dirs))
                 else:
                     print(f"Commit failed with exit code {result.returncode}", file=sys.stderr)
                     sys.exit(result.returncode)
@@ -484,9 +1890,19 @@ Notes:
                     pass
             sys.exit(0)
 
-        # In verbose mode, ask user for confirmation
+        # In verbose mode, ask user for confirmation. Without a terminal to
+        # ask on (scripts, CI) don't wait for an answer that can't come:
+        # only --auto-commit commits there.
         try:
-            user_approval = input("\nDo you want to commit with this message? (y/n/e to edit): ").lower()
+            if not sys.stdin.isatty():
+                print("\nstdin is not a terminal; not committing (use --auto-commit to commit anyway).")
+                user_approval = 'n'
+            else:
+                user_approval = timed_input(
+                    "\nDo you want to commit with this message? (y/n/e to edit): ",
+                    PROMPT_TIMEOUT_SECONDS,
+                    'n',
+                ).lower()
             should_commit = user_approval == 'y'
 
             if user_approval == 'e':
@@ -510,8 +1926,9 @@ Notes:
                     # stdout/stderr or stdin.
                     result = subprocess.run(commit_cmd)
                     if result.returncode == 0:
+                        remember_committed_message()
                         print("\n🎉 Commit successful!")
-                        print(run_command("git log -n 1 --pretty=oneline"))
+                        print(head_oneline(git_dirs))
                     else:
                         print(f"Commit failed with exit code {result.returncode}")
                         sys.exit(result.returncode)
@@ -535,7 +1952,7 @@ Notes:
         if args.verbose:
             print("\n📋 [DRY RUN] Would commit with the above message")
         else:
-            print("✅ Generated message (dry-run):")
+            print(f"✅ Generated message (dry-run{', cached' if is_cached else ''}):")
             print(suggested_message)
         sys.exit(0)
 
@@ -563,41 +1980,39 @@ Notes:
                     return True
             return False
 
+        # git's output goes straight to the terminal, so errors (hooks,
+        # signing, ...) are shown as they happen.
         try:
             if has_message_flag(commit_args):
                 # User provided a message or file flag; pass args through as-is.
                 commit_cmd.extend(commit_args)
-                subprocess.run(
-                    commit_cmd,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                )
+                subprocess.run(commit_cmd, check=True)
+                # Committed with the user's message, not the suggestion
+                suggested_message = None
             else:
                 # No message provided: read message from stdin using -F -
                 commit_cmd.extend(commit_args + ["-F", "-"])
-                subprocess.run(
-                    commit_cmd,
-                    input=suggested_message,
-                    text=True,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
+                message = suggested_message.encode('utf-8')
+                if len(message) <= COMMIT_PIPE_MAX_BYTES:
+                    # Fits in the pipe buffer: write it once up front and
+                    # hand git the read end, no feeder thread needed.
+                    r, w = os.pipe()
+                    try:
+                        # The buffered file retries short writes, and closes
+                        # the write end even if writing fails
+                        with os.fdopen(w, 'wb') as pipe:
+                            pipe.write(message)
+                        subprocess.run(commit_cmd, stdin=r, check=True)
+                    finally:
+                        os.close(r)
+                else:
+                    subprocess.run(commit_cmd, input=message, check=True)
 
+            remember_message(suggested_message)
             print("\n🎉 Commit successful!")
-            vprint(run_command("git log -n 1 --pretty=oneline"))
+            vprint(head_oneline(git_dirs))
         except subprocess.CalledProcessError as e:
-            print("Error executing git commit:")
-            stderr = e.stderr.strip() if hasattr(e, 'stderr') and e.stderr else ''
-            stdout = e.stdout.strip() if hasattr(e, 'stdout') and e.stdout else ''
-            if stderr:
-                print(stderr)
-            elif stdout:
-                print(stdout)
-            else:
-                print(str(e))
+            print(f"Commit failed with exit code {e.returncode}", file=sys.stderr)
             sys.exit(1)
     else:
         if args.verbose:
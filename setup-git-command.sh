@@ -28,14 +28,12 @@ else
     echo -e "${GREEN}✓ Dependencies already satisfied${NC}"
 fi
 
-# Step 2: Rename and make executable
+# Step 2: Make executable
+# ai-commit.py is the single source of the command: it is installed under
+# its git-subcommand name directly, so no stale intermediate copy is left
+# behind to be re-installed after the script is updated.
 echo -e "\n${BLUE}Step 2: Preparing git command script...${NC}"
-if [ ! -f "git-ai-commit" ]; then
-    cp ai-commit.py git-ai-commit
-    echo -e "${GREEN}✓ Created git-ai-commit${NC}"
-fi
-
-chmod +x git-ai-commit
+chmod +x ai-commit.py
 echo -e "${GREEN}✓ Script is executable${NC}"
 
 # Step 3: Install to PATH
@@ -43,7 +41,7 @@ echo -e "\n${BLUE}Step 3: Installing to PATH...${NC}"
 
 # Try user-level first (recommended, no sudo)
 if [ -d "$HOME/.local/bin" ]; then
-    cp git-ai-commit "$HOME/.local/bin/"
+    install -m 755 ai-commit.py "$HOME/.local/bin/git-ai-commit"
     INSTALL_PATH="$HOME/.local/bin"
     echo -e "${GREEN}✓ Installed to $INSTALL_PATH${NC}"
 
@@ -60,7 +58,7 @@ else
     # Fallback to /usr/local/bin (requires sudo)
     echo -e "${YELLOW}Creating ~/.local/bin...${NC}"
     mkdir -p "$HOME/.local/bin"
-    cp git-ai-commit "$HOME/.local/bin/"
+    install -m 755 ai-commit.py "$HOME/.local/bin/git-ai-commit"
     INSTALL_PATH="$HOME/.local/bin"
     echo -e "${GREEN}✓ Installed to $INSTALL_PATH${NC}"
 fi
@@ -0,0 +1,220 @@
+"""Tests for serving the instructions and guidelines from a context cache."""
+
+import importlib.util
+import io
+import os
+import tempfile
+import types
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-commit.py")
+spec = importlib.util.spec_from_file_location("ai_commit", SCRIPT)
+ai_commit = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ai_commit)
+
+# Guidelines the size of a real project's commit policy, which together
+# with the instructions is past CACHE_MIN_CHARS
+GUIDELINES = """\
+Commit message guidelines
+
+1. Subject line. Start the subject with the subsystem the change touches,
+followed by a colon and a space, e.g. "net: ", "mm/slab: " or "docs: ".
+Use the imperative mood ("Fix", "Add", "Remove"), keep it under 72
+characters, and don't end it with a period. Look at `git log --oneline`
+for the file you touch to find the prefix other people used.
+
+2. Body. Leave one blank line after the subject. Explain the problem the
+change solves before describing the solution, and say why the solution is
+right rather than retelling the diff line by line. Wrap the body at 72
+columns. Describe user-visible changes in behavior explicitly, including
+which configurations are affected and which are not.
+
+3. One logical change per commit. Refactors go in their own commits before
+the functional change; whitespace and style cleanups never go together
+with behavior changes. Every commit must build and pass the test suite on
+its own so that bisecting keeps working.
+
+4. References. Quote bug tracker IDs on their own line as "Bug: PROJ-123".
+When fixing a regression, add a "Fixes: <12 character sha> ("subject")"
+line pointing at the commit that introduced it. Link mailing list threads
+with "Link: <url>", never with bare URLs in the text.
+
+5. Credit. Keep "Reported-by:", "Suggested-by:", "Reviewed-by:" and
+"Tested-by:" tags in that order, one per line, after the body. Every
+commit carries the author's "Signed-off-by:" line as the last tag.
+
+6. Reverts. Keep the subject git generates ("Revert "..."") and explain in
+the body why the change is being reverted and what the plan is instead.
+
+7. Security fixes. Don't describe how to exploit the problem; state the
+affected versions and the impact in one sentence, and add the CVE ID as a
+"CVE:" tag once one is assigned.
+
+8. Performance changes. Quote the benchmark used and the numbers before and
+after the change, with the machine and configuration they were measured
+on. Changes without measurements are discussed as cleanups instead.
+
+9. API and ABI changes. Say whether the change breaks callers, which
+release introduced the interface, and how out-of-tree users should adapt.
+Deprecations name the replacement and the release the old interface goes
+away in.
+
+10. Translations and generated files. Commits that only regenerate files
+say which tool and version produced them, and are never mixed with
+hand-written changes.
+
+11. Language. Write in plain English, spell out abbreviations the first
+time they appear, and avoid jokes or references that need context only the
+author has. Don't mention private chats, internal tickets or names of
+people who didn't agree to be credited.
+
+12. Stable backports. Keep the original subject and body, and add a line
+"commit <sha> upstream." right after the subject. Note any change needed
+to make the patch apply, in brackets, before the sign-off of whoever made
+it.
+
+13. Merge commits. Summarize what the merged branch brings, grouped by
+subsystem, and list conflicts that had to be resolved by hand, with the
+reason for the resolution that was chosen.
+"""
+
+
+class APIError(Exception):
+    """Stands in for the SDK's errors, which carry the HTTP status."""
+
+    def __init__(self, code=None):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+class FakeClient:
+    """Records what the code asks of the Gemini API, failing as told."""
+
+    def __init__(self, cache_errors=(), request_errors=()):
+        self.cache_errors = list(cache_errors)
+        self.request_errors = list(request_errors)
+        self.created = []
+        self.requests = []
+        self.caches = types.SimpleNamespace(create=self.create_cache)
+        self.models = types.SimpleNamespace(
+            generate_content=self.generate_content,
+            generate_content_stream=self.generate_content_stream,
+        )
+
+    def create_cache(self, model, config):
+        if self.cache_errors:
+            raise self.cache_errors.pop(0)
+        self.created.append(config)
+        return types.SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def generate_content(self, model, contents, config):
+        self.requests.append((contents, config))
+        if self.request_errors:
+            raise self.request_errors.pop(0)
+        return types.SimpleNamespace(text="fix: something\n")
+
+    def generate_content_stream(self, model, contents, config):
+        self.requests.append((contents, config))
+        yield types.SimpleNamespace(text="fix: some")
+        if self.request_errors:
+            raise self.request_errors.pop(0)
+        yield types.SimpleNamespace(text="thing\n")
+
+
+def config(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+class ContextCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patch in (
+            mock.patch.dict(os.environ, {"XDG_CACHE_HOME": tmp.name}),
+            mock.patch.object(ai_commit, "load_genai", lambda: None),
+            mock.patch.object(ai_commit, "types", types.SimpleNamespace(
+                CreateCachedContentConfig=config, GenerateContentConfig=config,
+            )),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def generate(self, client, guidelines=GUIDELINES, stream=False):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            message = ai_commit.generate_commit_message(
+                "diff --git a/a.py b/a.py", "history", guidelines=guidelines, stream=stream, client=client,
+            )
+        return message, out.getvalue()
+
+    def test_realistic_guidelines_are_cached(self):
+        prefix = ai_commit.GUIDELINES_SECTION_TEMPLATE.format_map({"guidelines": GUIDELINES})
+        self.assertGreaterEqual(len(ai_commit.SYSTEM_INSTRUCTIONS) + len(prefix), ai_commit.CACHE_MIN_CHARS)
+        client = FakeClient()
+        self.assertEqual(self.generate(client)[0], "fix: something")
+        self.assertEqual(len(client.created), 1)
+        self.assertEqual(client.created[0].contents, [prefix])
+        contents, request_config = client.requests[0]
+        self.assertEqual(request_config.cached_content, "cachedContents/1")
+        self.assertNotIn(GUIDELINES, contents)
+
+    def test_cache_is_reused_by_later_runs(self):
+        client = FakeClient()
+        self.generate(client)
+        self.generate(client)
+        self.assertEqual(len(client.created), 1)
+        self.assertEqual([c.cached_content for _, c in client.requests], ["cachedContents/1"] * 2)
+
+    def test_short_prompt_is_sent_inline(self):
+        client = FakeClient()
+        self.generate(client, guidelines="Use a [subsystem] prefix.")
+        self.assertEqual(client.created, [])
+        contents, request_config = client.requests[0]
+        self.assertEqual(request_config.system_instruction, ai_commit.SYSTEM_INSTRUCTIONS)
+        self.assertIn("Use a [subsystem] prefix.", contents)
+
+    def test_rejected_cache_falls_back_inline(self):
+        client = FakeClient(request_errors=[APIError(404)])
+        self.assertEqual(self.generate(client)[0], "fix: something")
+        self.assertEqual(len(client.requests), 2)
+        self.assertIn(GUIDELINES, client.requests[1][0])
+        self.assertEqual(ai_commit.load_cached_content_index(), {})
+
+    def test_network_error_is_not_retried_inline(self):
+        client = FakeClient(request_errors=[ConnectionError("unreachable")])
+        with self.assertRaises(SystemExit):
+            self.generate(client)
+        self.assertEqual(len(client.requests), 1)
+
+    def test_failure_midway_through_a_stream_is_not_retried(self):
+        client = FakeClient(request_errors=[APIError(404)])
+        with self.assertRaises(SystemExit):
+            self.generate(client, stream=True)
+        self.assertEqual(len(client.requests), 1)
+
+    def test_refused_cache_is_not_retried_for_a_while(self):
+        client = FakeClient(cache_errors=[APIError(400)])
+        self.generate(client)
+        self.generate(client)
+        self.assertEqual(client.created, [])
+        self.assertEqual([c.system_instruction for _, c in client.requests], [ai_commit.SYSTEM_INSTRUCTIONS] * 2)
+
+    def test_cache_creation_is_retried_after_a_network_error(self):
+        client = FakeClient(cache_errors=[ConnectionError("unreachable")])
+        self.generate(client)
+        self.generate(client)
+        self.assertEqual(len(client.created), 1)
+
+    def test_malformed_index_is_ignored(self):
+        path = os.path.join(ai_commit.get_user_cache_dir(), "cached_content.json")
+        os.makedirs(os.path.dirname(path))
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write('{"a": "not an entry", "b": {"name": "cachedContents/9"}}')
+        self.assertEqual(ai_commit.load_cached_content_index(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Tests for the exact message cache and the staged diff fingerprint."""
+
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-commit.py")
+spec = importlib.util.spec_from_file_location("ai_commit", SCRIPT)
+ai_commit = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ai_commit)
+
+
+def fingerprint(diff):
+    digest = hashlib.sha256()
+    lines = [line + b"\n" for line in diff.encode("utf-8").splitlines()]
+    list(ai_commit.digest_diff_lines(lines, digest, hashlib.sha256()))
+    return digest.hexdigest()
+
+
+class MessageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "ai-commit-cache.json")
+
+    def test_missing_or_malformed_cache_is_empty(self):
+        self.assertEqual(ai_commit.load_message_cache(self.path), {})
+        for content in ("not json", "[1, 2]"):
+            with open(self.path, "w", encoding="utf-8") as fh:
+                fh.write(content)
+            self.assertEqual(ai_commit.load_message_cache(self.path), {})
+
+    def test_save_and_load(self):
+        cache = {}
+        ai_commit.save_message_cache(self.path, cache, "k", {"inputs": "i", "message": "fix: x"})
+        self.assertEqual(ai_commit.load_message_cache(self.path), {"k": {"inputs": "i", "message": "fix: x"}})
+
+    def test_least_recently_used_entries_are_dropped(self):
+        cache = {}
+        with mock.patch.object(ai_commit, "MESSAGE_CACHE_ENTRIES", 2):
+            ai_commit.save_message_cache(self.path, cache, "a", {"message": "a"})
+            ai_commit.save_message_cache(self.path, cache, "b", {"message": "b"})
+            # Using "a" again makes "b" the oldest one
+            ai_commit.save_message_cache(self.path, cache, "a", {"message": "a2"})
+            ai_commit.save_message_cache(self.path, cache, "c", {"message": "c"})
+        with open(self.path, encoding="utf-8") as fh:
+            self.assertEqual(list(json.load(fh)), ["a", "c"])
+
+    def test_key_depends_on_the_fingerprint(self):
+        self.assertEqual(ai_commit.message_cache_key("f1"), ai_commit.message_cache_key("f1"))
+        self.assertNotEqual(ai_commit.message_cache_key("f1"), ai_commit.message_cache_key("f2"))
+
+
+class FingerprintTest(unittest.TestCase):
+
+    DIFF = "\n".join([
+        "diff --git a/a.py b/a.py",
+        "index 3b18e51..a5c1966 100644",
+        "--- a/a.py",
+        "+++ b/a.py",
+        "@@ -1,2 +1,2 @@",
+        " import os",
+        "-x = 1",
+        "+x = 2",
+    ])
+
+    def test_blob_ids_and_trailing_whitespace_are_ignored(self):
+        restaged = self.DIFF.replace("3b18e51..a5c1966", "0000000..1111111").replace("+x = 2", "+x = 2  ")
+        self.assertEqual(fingerprint(self.DIFF), fingerprint(restaged))
+
+    def test_changed_line_changes_the_fingerprint(self):
+        self.assertNotEqual(fingerprint(self.DIFF), fingerprint(self.DIFF.replace("+x = 2", "+x = 3")))
+
+    def test_hunk_position_changes_the_fingerprint(self):
+        self.assertNotEqual(fingerprint(self.DIFF), fingerprint(self.DIFF.replace("-1,2 +1,2", "-5,2 +5,2")))
+
+
+class ReadStagedDiffTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.repo = tmp.name
+        self.git("init", "-q")
+        cwd = os.getcwd()
+        os.chdir(self.repo)
+        self.addCleanup(os.chdir, cwd)
+
+    def git(self, *args):
+        subprocess.run(["git", "-C", self.repo, *args], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stage(self, name, content):
+        with open(os.path.join(self.repo, name), "w", encoding="utf-8") as fh:
+            fh.write(content)
+        self.git("add", name)
+
+    def test_nothing_staged(self):
+        diff, _, _ = ai_commit.read_staged_diff()
+        self.assertEqual(diff, "")
+
+    def test_content_past_the_read_limit_changes_the_fingerprint(self):
+        self.stage("big.txt", "x\n" * 100)
+        self.stage("tail.txt", "one\n")
+        with mock.patch.object(ai_commit, "DIFF_READ_LIMIT_BYTES", 100):
+            diff, first, _ = ai_commit.read_staged_diff()
+            self.assertNotIn("+one", diff)
+            self.stage("tail.txt", "two\n")
+            _, second, _ = ai_commit.read_staged_diff()
+        self.assertNotEqual(first, second)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Tests for the semantic message cache (embed_diff, find_similar_message)."""
+
+import hashlib
+import importlib.util
+import os
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-commit.py")
+spec = importlib.util.spec_from_file_location("ai_commit", SCRIPT)
+ai_commit = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ai_commit)
+
+INPUTS = ai_commit.prompt_inputs_hash(None, None)
+
+
+def staged_diff(path, removed, added, start=10, context=("def connect():",)):
+    """Builds a `git diff --staged` of one hunk, with context lines."""
+    lines = [
+        f"diff --git a/{path} b/{path}",
+        "index 3b18e51..a5c1966 100644",
+        f"--- a/{path}",
+        f"+++ b/{path}",
+        f"@@ -{start},3 +{start},3 @@",
+    ]
+    lines.extend(" " + line for line in context)
+    lines.extend("-" + line for line in removed)
+    lines.extend("+" + line for line in added)
+    return "\n".join(lines) + "\n"
+
+
+def digests(diff):
+    """Returns the (fingerprint, changes) digests of a diff."""
+    fingerprint, changes = hashlib.sha256(), hashlib.sha256()
+    lines = [line + b"\n" for line in diff.encode("utf-8").splitlines()]
+    assert list(ai_commit.digest_diff_lines(lines, fingerprint, changes)) == lines
+    return fingerprint.hexdigest(), changes.hexdigest()
+
+
+def entry_for(diff, message, inputs=INPUTS):
+    return {
+        "embedding": ai_commit.embed_diff(diff),
+        "changes": digests(diff)[1],
+        "inputs": inputs,
+        "message": message,
+    }
+
+
+def lookup(entries, diff, inputs=INPUTS):
+    return ai_commit.find_similar_message(
+        entries, ai_commit.embed_diff(diff), digests(diff)[1], inputs
+    )
+
+
+class SemanticCacheTest(unittest.TestCase):
+
+    def test_opposite_changes_are_not_reused(self):
+        longer = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 60"])
+        shorter = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 10"])
+        reusable, similar = lookup([entry_for(longer, "fix: raise the timeout")], shorter)
+        self.assertFalse(reusable)
+        # Close enough to be adapted by the model, but never reused as is
+        self.assertEqual(similar["message"], "fix: raise the timeout")
+
+    def test_negated_condition_is_not_reused(self):
+        before = ["    if user.is_admin or user.is_staff:"]
+        either = staged_diff("auth.py", before, ["    if user.is_admin and user.is_staff:"])
+        negated = staged_diff("auth.py", before, ["    if not user.is_admin:"])
+        reusable, _ = lookup([entry_for(either, "fix: require both roles")], negated)
+        self.assertFalse(reusable)
+
+    def test_same_changes_elsewhere_are_reused(self):
+        first = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 60"])
+        moved = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 60"],
+                            start=42, context=("def reconnect():",))
+        self.assertNotEqual(digests(first)[0], digests(moved)[0])
+        reusable, similar = lookup([entry_for(first, "fix: raise the timeout")], moved)
+        self.assertTrue(reusable)
+        self.assertEqual(similar["message"], "fix: raise the timeout")
+
+    def test_other_inputs_are_ignored(self):
+        diff = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 60"])
+        other = ai_commit.prompt_inputs_hash(None, "part of PROJ-123")
+        self.assertEqual(lookup([entry_for(diff, "fix: x", inputs=other)], diff), (False, None))
+
+    def test_unrelated_change_is_not_adapted(self):
+        diff = staged_diff("net.py", ["    timeout = 30"], ["    timeout = 60"])
+        unrelated = staged_diff("README.md", ["Install with pip."], ["Install with pipx, then run it."],
+                                context=("## Usage",))
+        self.assertEqual(lookup([entry_for(diff, "fix: x")], unrelated), (False, None))
+
+    def test_embedding_has_unit_length(self):
+        embedding = ai_commit.embed_diff(staged_diff("a.py", ["x = 1"], ["x = 2"]))
+        self.assertEqual(len(embedding), ai_commit.EMBEDDING_DIMENSIONS)
+        self.assertAlmostEqual(sum(v * v for v in embedding), 1.0, places=2)
+
+    def test_empty_diff_has_no_embedding(self):
+        self.assertIsNone(ai_commit.embed_diff(""))
+
+    def test_changes_digest_covers_removed_dash_lines(self):
+        # A removed "-- x" line reads "--- x", like a file header
+        sql = staged_diff("q.sql", ["-- old"], ["-- new"], context=("SELECT 1;",))
+        other = staged_diff("q.sql", ["-- other"], ["-- new"], context=("SELECT 1;",))
+        self.assertNotEqual(digests(sql)[1], digests(other)[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+"""Tests for the trivial-diff classifier (trivial_commit_message)."""
+
+import importlib.util
+import os
+import subprocess
+import tempfile
+import unittest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-commit.py")
+spec = importlib.util.spec_from_file_location("ai_commit", SCRIPT)
+ai_commit = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ai_commit)
+
+
+def file_diff(path, *hunks):
+    """Builds a compressed diff of `path`; each hunk is (removed, added)."""
+    lines = [f"diff --git a/{path} b/{path}", f"--- a/{path}", f"+++ b/{path}"]
+    for n, (removed, added) in enumerate(hunks):
+        lines.append(f"@@ -{n * 10 + 1},3 +{n * 10 + 1},3 @@")
+        lines.extend("-" + line for line in removed)
+        lines.extend("+" + line for line in added)
+    return "\n".join(lines)
+
+
+def classify(diff, whitespace_confirmed=True, versions=None):
+    """Classifies `diff`; `versions` maps paths to their (HEAD, staged) texts."""
+    return ai_commit.trivial_commit_message(
+        diff,
+        confirm_whitespace=lambda: whitespace_confirmed,
+        read_versions=lambda paths: {p: v for p, v in (versions or {}).items() if p in paths},
+    )
+
+
+class TrivialCommitMessageTest(unittest.TestCase):
+
+    def test_trailing_whitespace(self):
+        diff = file_diff("a.py", (["x = 1  ", "y = 2"], ["x = 1", "y = 2", ""]))
+        self.assertEqual(classify(diff), "style: fix whitespace in a.py")
+
+    def test_whitespace_not_confirmed_by_git(self):
+        diff = file_diff("a.py", (["x = 1  "], ["x = 1"]))
+        self.assertIsNone(classify(diff, whitespace_confirmed=False))
+
+    def test_reindented_code_is_not_whitespace(self):
+        diff = file_diff("b.py", (["        return x"], ["    return x"]))
+        self.assertIsNone(classify(diff))
+
+    def test_line_moved_across_hunks_is_not_whitespace(self):
+        diff = file_diff("b.py", (["a()"], []), ([], ["a()"]))
+        self.assertIsNone(classify(diff))
+
+    def test_version_bump(self):
+        diff = file_diff("package.json", (['  "version": "1.0.0",'], ['  "version": "1.0.1",']))
+        versions = {"package.json": ('{\n  "name": "x",\n  "version": "1.0.0",\n  "main": "i.js"\n}\n',
+                                     '{\n  "name": "x",\n  "version": "1.0.1",\n  "main": "i.js"\n}\n')}
+        self.assertEqual(classify(diff, versions=versions), "chore: bump version to 1.0.1")
+
+    def test_pyproject_version_bump(self):
+        diff = file_diff("pyproject.toml", (['version = "0.9.0"'], ['version = "1.0.0rc1"']))
+        versions = {"pyproject.toml": ('[project]\nname = "x"\nversion = "0.9.0"\n',
+                                       '[project]\nname = "x"\nversion = "1.0.0rc1"\n')}
+        self.assertEqual(classify(diff, versions=versions), "chore: bump version to 1.0.0rc1")
+
+    def test_version_bump_needs_the_file_contents(self):
+        diff = file_diff("package.json", (['  "version": "1.0.0",'], ['  "version": "1.0.1",']))
+        self.assertIsNone(classify(diff))
+
+    def test_dependency_version_is_not_a_bump(self):
+        diff = file_diff("Cargo.toml", (['version = "1.0"'], ['version = "1.1"']))
+        old = '[package]\nname = "x"\nversion = "0.3.0"\n\n[dependencies.serde]\nversion = "1.0"\n'
+        versions = {"Cargo.toml": (old, old.replace('"1.0"', '"1.1"'))}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_version_variable_in_code_is_not_a_bump(self):
+        diff = file_diff("client.py", (['    version = "1.0.0"'], ['    version = "2.0.0"']))
+        old = 'def f():\n    version = "1.0.0"\n    return version\n'
+        versions = {"client.py": (old, old.replace("1.0.0", "2.0.0"))}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_non_version_value_is_not_a_bump(self):
+        diff = file_diff("setup.cfg", (["version = abc"], ["version = def"]))
+        versions = {"setup.cfg": ("[metadata]\nversion = abc\n", "[metadata]\nversion = def\n")}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_python_comment(self):
+        diff = file_diff("a.py", (["# old note"], ["# new note", "#"]))
+        versions = {"a.py": ("x = 1\n# old note\n", "x = 1\n# new note\n#\n")}
+        self.assertEqual(classify(diff, versions=versions), "docs: update comments in a.py")
+
+    def test_hash_line_in_python_string_is_code(self):
+        diff = file_diff("a.py", (["# old"], ["# new"]))
+        versions = {"a.py": ('HELP = """\n# old\n"""\n', 'HELP = """\n# new\n"""\n')}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_comment_needs_the_file_contents(self):
+        diff = file_diff("a.py", (["# old note"], ["# new note"]))
+        self.assertIsNone(classify(diff))
+
+    def test_c_comments(self):
+        diff = file_diff("a.c", (["// old", " * old line"], ["/* new */", " * new line", " */"]))
+        versions = {"a.c": ("int x;\n// old\n/*\n * old line */\n",
+                            "int x;\n/* new */\n/*\n * new line\n */\n")}
+        self.assertEqual(classify(diff, versions=versions), "docs: update comments in a.c")
+
+    def test_slashes_in_template_literal_are_code(self):
+        diff = file_diff("a.js", (["// old"], ["// new"]))
+        versions = {"a.js": ("const s = `\n// old\n`;\n", "const s = `\n// new\n`;\n")}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_shell_comments_are_left_to_the_model(self):
+        diff = file_diff("run.sh", (["# old"], ["# new"]))
+        versions = {"run.sh": ("cat <<EOF\n# old\nEOF\n", "cat <<EOF\n# new\nEOF\n")}
+        self.assertIsNone(classify(diff, versions=versions))
+
+    def test_c_pointer_assignment_is_code(self):
+        diff = file_diff("a.c", (["*p = 1;"], ["*p = 2;"]))
+        self.assertIsNone(classify(diff))
+
+    def test_code_after_block_comment_is_code(self):
+        diff = file_diff("a.c", (["/* x */ f();"], ["/* x */ g();"]))
+        self.assertIsNone(classify(diff))
+
+    def test_css_id_selector_is_code(self):
+        diff = file_diff("style.css", (["#header {"], ["#banner {"]))
+        self.assertIsNone(classify(diff))
+
+    def test_c_preprocessor_is_code(self):
+        diff = file_diff("a.c", (["#include <a.h>"], ["#include <b.h>"]))
+        self.assertIsNone(classify(diff))
+
+    def test_shebang_is_code(self):
+        diff = file_diff("run.sh", (["#!/bin/sh"], ["#!/bin/bash"]))
+        self.assertIsNone(classify(diff))
+
+    def test_unknown_file_type(self):
+        diff = file_diff("notes.txt", (["# a"], ["# b"]))
+        self.assertIsNone(classify(diff))
+
+    def test_truncated_diff(self):
+        diff = file_diff("a.py", (["# a"], ["# b"])) + "\n... (3 lines omitted) ..."
+        self.assertIsNone(classify(diff))
+
+    def test_new_file(self):
+        diff = "\n".join([
+            "diff --git a/a.py b/a.py", "new file mode 100644", "--- /dev/null", "+++ b/a.py",
+            "@@ -0,0 +1 @@", "+# comment",
+        ])
+        self.assertIsNone(classify(diff))
+
+
+class ReadStagedVersionsTest(unittest.TestCase):
+
+    def test_reads_head_and_staged_versions(self):
+        with tempfile.TemporaryDirectory() as repo:
+            def git(*args):
+                subprocess.run(["git", "-C", repo, "-c", "user.name=t", "-c", "user.email=t@t", *args],
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            def write(name, content):
+                with open(os.path.join(repo, name), "w", encoding="utf-8") as fh:
+                    fh.write(content)
+            git("init", "-q")
+            write("a.py", "# old\n")
+            git("add", "a.py")
+            git("commit", "-q", "-m", "init")
+            write("a.py", "# new\n")
+            write("b.py", "x = 1\n")
+            git("add", "a.py", "b.py")
+            cwd = os.getcwd()
+            os.chdir(repo)
+            try:
+                versions = ai_commit.read_staged_versions(["a.py", "b.py"])
+            finally:
+                os.chdir(cwd)
+        # b.py is new, so it has no HEAD version
+        self.assertEqual(versions, {"a.py": ("# old\n", "# new\n")})
+
+
+if __name__ == "__main__":
+    unittest.main()